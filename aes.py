@@ -1,6 +1,19 @@
 #Contains all the AES tables (app for appendix)
 import app
 
+# Derived lookup tables shared through a cache file
+import tables
+
+# Used for the key schedule cache and block packing
+from collections import OrderedDict
+import struct
+
+# NumPy is only needed for aesBatch
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 #NOTE: In the following functions, text and key are 
 #      assumed to be 4x4 tables of bytes, represented 
@@ -108,10 +121,33 @@ def keyExpansion(key, decrypt = False):
     return subkeys
 
 
-# Description: Encrypts (or decrypts) plaintext using key via AES.
-# Note:        This algorithm uses AES-128, so we assume a plaintext
-#              and key length of 128 bits and perform 10 rounds.             
-def aes(plaintext, key, decrypt = False):
+# Description: For every output column, the columns of the input
+#              state that feed rows 0 - 3 after ShiftRows.
+def shiftColumns(matrix):
+    return [[matrix[4*c + r] // 4 for r in range(4)] for c in range(4)]
+
+
+# Table-driven engine data: (T-tables, S-box, column sources) for
+# encryption (index 0) and decryption (index 1). The T-tables come
+# from the table cache (see tables.aesTables), copied into lists.
+TABLES = [(tables.lists("Te"), tables.BASE["S"], shiftColumns(app.SR)),
+          (tables.lists("Td"), tables.BASE["oS"], shiftColumns(app.oSR))]
+
+
+# Description: Converts a key schedule from keyExpansion into a flat
+#              list of 32-bit words, four per round key.
+def scheduleWords(keySchedule):
+    words = []
+    for subkey in keySchedule:
+        for c in range(4):
+            words.append((subkey[4*c] << 24) | (subkey[4*c + 1] << 16) |
+                         (subkey[4*c + 2] << 8) | subkey[4*c + 3])
+    return words
+
+
+# Description: Runs AES on a 128-bit integer with the reference
+#              byte-list round functions defined above.
+def referenceBlock(plaintext, keySchedule, decrypt = False):
     ciphertext = 0
 
     # Put plaintext in list
@@ -120,9 +156,6 @@ def aes(plaintext, key, decrypt = False):
     # Choose correct matrices (encryption vs decryption)
     box = [app.oS, app.oSR, app.oMC] if decrypt else [app.S, app.SR, app.MC]
 
-    # Get key schedule
-    keySchedule = keyExpansion(key, decrypt)
-
     # Initial transformation
     AddRoundKey(text, keySchedule[0])
 
@@ -145,4 +178,230 @@ def aes(plaintext, key, decrypt = False):
     return ciphertext
 
 
+# Reads and writes a block as four big-endian 32-bit words
+BLOCK = struct.Struct(">4I")
+
+
+# Description: Runs AES with the T-tables on the 16 bytes of src at
+#              srcOffset and writes the result into dst at dstOffset
+#              (dst may be src). Each round is sixteen word lookups
+#              and XORs; no block-sized int or byte list is built.
+# Note:        words is the key schedule as given by scheduleWords.
+def tableBlockInto(src, srcOffset, dst, dstOffset, words, decrypt = False):
+    (T0, T1, T2, T3), box, cols = TABLES[decrypt]
+    (a0, b0, c0, d0), (a1, b1, c1, d1), (a2, b2, c2, d2), (a3, b3, c3, d3) = cols
+
+    # Initial transformation
+    w0, w1, w2, w3 = BLOCK.unpack_from(src, srcOffset)
+    s = [w0 ^ words[0], w1 ^ words[1], w2 ^ words[2], w3 ^ words[3]]
+
+    # Rounds 1 - 9
+    for i in range(4, 40, 4):
+        s = [T0[s[a0] >> 24] ^ T1[(s[b0] >> 16) & 0xff] ^
+             T2[(s[c0] >> 8) & 0xff] ^ T3[s[d0] & 0xff] ^ words[i],
+             T0[s[a1] >> 24] ^ T1[(s[b1] >> 16) & 0xff] ^
+             T2[(s[c1] >> 8) & 0xff] ^ T3[s[d1] & 0xff] ^ words[i + 1],
+             T0[s[a2] >> 24] ^ T1[(s[b2] >> 16) & 0xff] ^
+             T2[(s[c2] >> 8) & 0xff] ^ T3[s[d2] & 0xff] ^ words[i + 2],
+             T0[s[a3] >> 24] ^ T1[(s[b3] >> 16) & 0xff] ^
+             T2[(s[c3] >> 8) & 0xff] ^ T3[s[d3] & 0xff] ^ words[i + 3]]
+
+    # Final Round (S-box and shift only)
+    BLOCK.pack_into(dst, dstOffset, *[
+        ((box[s[a] >> 24] << 24) | (box[(s[b] >> 16) & 0xff] << 16) |
+         (box[(s[d] >> 8) & 0xff] << 8) | box[s[e] & 0xff]) ^ words[40 + c]
+        for c, (a, b, d, e) in enumerate(cols)])
+
+
+# Description: Runs AES on a 128-bit integer with the T-tables (a
+#              wrapper around tableBlockInto).
+def tableBlock(plaintext, words, decrypt = False):
+    block = bytearray(plaintext.to_bytes(16, "big"))
+    tableBlockInto(block, 0, block, 0, words, decrypt)
+    return int.from_bytes(block, "big")
+
+
+# Description: A bounded least-recently-used cache of expanded
+#              key schedules keyed by (key, decrypt). Schedules are
+#              stored as tuples of words in the scheduleWords format.
+# Note:        hits and misses count lookups since the last clear.
+class ScheduleCache:
+    def __init__(self, maxsize = 128):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = self.misses = 0
+
+    # Description: Returns the schedule for (key, decrypt), expanding
+    #              and storing it if it is not cached yet.
+    def get(self, key, decrypt = False):
+        entry = (key, bool(decrypt))
+        words = self.entries.get(entry)
+
+        if(words is not None):
+            self.hits += 1
+            self.entries.move_to_end(entry)
+            return words
+
+        # Expand and evict the least recently used schedule if full
+        self.misses += 1
+        words = tuple(scheduleWords(keyExpansion(key, decrypt)))
+        self.entries[entry] = words
+        if(len(self.entries) > self.maxsize):
+            self.entries.popitem(last = False)
+        return words
+
+    # Description: Returns the cache counters as a dict.
+    def info(self):
+        return {"hits": self.hits, "misses": self.misses,
+                "size": len(self.entries), "maxsize": self.maxsize}
+
+    # Description: Empties the cache and resets the counters.
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = 0
+
+
+# Schedule cache shared by aes and AES objects.
+scheduleCache = ScheduleCache()
+
+
+# Description: An AES-128 cipher bound to one key. Both the encrypt
+#              and decrypt schedules are expanded once on creation,
+#              so encrypting or decrypting a block does no key work.
+class AES:
+    blockSize = 16
+
+    def __init__(self, key, cache = scheduleCache):
+        self.key = key
+        self.encryptWords = cache.get(key, False)
+        self.decryptWords = cache.get(key, True)
+
+    # Description: Encrypts one 128-bit integer block.
+    def encrypt(self, plaintext):
+        return tableBlock(plaintext, self.encryptWords, False)
+
+    # Description: Decrypts one 128-bit integer block.
+    def decrypt(self, ciphertext):
+        return tableBlock(ciphertext, self.decryptWords, True)
+
+    # Description: Encrypts (or decrypts) the block of src at srcOffset
+    #              into dst at dstOffset, without int conversions.
+    def encryptInto(self, src, srcOffset, dst, dstOffset):
+        tableBlockInto(src, srcOffset, dst, dstOffset, self.encryptWords, False)
+
+    def decryptInto(self, src, srcOffset, dst, dstOffset):
+        tableBlockInto(src, srcOffset, dst, dstOffset, self.decryptWords, True)
+
+
+# Available block engines. Each entry pairs the function that
+# builds the engine's key schedule from (key, decrypt) with the
+# function that runs the rounds.
+BACKENDS = {"reference": (keyExpansion, referenceBlock),
+            "table": (scheduleCache.get, tableBlock)}
+
+# Engine used by aes when no backend is given.
+BACKEND = "table"
+
+
+# Description: Encrypts (or decrypts) plaintext using key via AES.
+# Note:        This algorithm uses AES-128, so we assume a plaintext
+#              and key length of 128 bits and perform 10 rounds.             
+# Note:        backend selects an entry of BACKENDS and defaults to
+#              the module-level BACKEND.
+def aes(plaintext, key, decrypt = False, backend = None):
+    prepare, block = BACKENDS[backend or BACKEND]
+    return block(plaintext, prepare(key, decrypt), decrypt)
+
+
+# Description: Lazily built NumPy tables for aesBatch: for each
+#              direction the S-box, ShiftRows permutation and one
+#              multiplication table per MixColumns matrix entry
+#              (rows of the shared GF(2^8) table, not copied).
+BATCH_TABLES = {}
+def batchTables(decrypt):
+    if(decrypt not in BATCH_TABLES):
+        box, shift, matrix = ((app.oS, app.oSR, app.oMC) if decrypt
+                              else (app.S, app.SR, app.MC))
+        mul = {e: np.frombuffer(tables.get("GF")[e], np.uint8) for e in set(matrix)}
+        BATCH_TABLES[decrypt] = (np.array(box, np.uint8), np.array(shift),
+                                 [[mul[matrix[4*r + j]] for j in range(4)]
+                                  for r in range(4)])
+    return BATCH_TABLES[decrypt]
+
+
+# Description: Encrypts (or decrypts) N blocks at once. blocks is an
+#              (N,16) uint8 array with bytes in the same order as the
+#              128-bit integers taken by aes; each round step runs over
+#              all N blocks as array operations.
+def aesBatch(blocks, key, decrypt = False):
+    if(np is None):
+        raise ImportError("aesBatch requires NumPy")
+
+    box, shift, mul = batchTables(bool(decrypt))
+    words = np.array(scheduleCache.get(key, decrypt), ">u4")
+    keys = words.view(np.uint8).reshape(11, 16)
+
+    # Initial transformation
+    text = np.asarray(blocks, np.uint8).reshape(-1, 16) ^ keys[0]
+
+    for i in range(1, 11):
+        # SubBytes and ShiftRows as gathers
+        text = box[text][:, shift]
+
+        # MixColumns on (N, column, row) views (skipped in round 10)
+        if(i < 10):
+            columns = text.reshape(-1, 4, 4)
+            mixed = np.empty_like(columns)
+            for r in range(4):
+                mixed[:, :, r] = (mul[r][0][columns[:, :, 0]] ^ mul[r][1][columns[:, :, 1]] ^
+                                  mul[r][2][columns[:, :, 2]] ^ mul[r][3][columns[:, :, 3]])
+            text = mixed.reshape(-1, 16)
+
+        text ^= keys[i]
+
+    return text
+
+
+# FIPS-197 Appendix C.1 known-answer vector (key, plaintext, ciphertext)
+KAT = (0x000102030405060708090a0b0c0d0e0f,
+       0x00112233445566778899aabbccddeeff,
+       0x69c4e0d86a7b0430d8cdb78070b4c55a)
+
+
+# Description: Checks every backend against the known-answer vector
+#              in both directions. Returns a dict of backend -> bool.
+def selfTest():
+    key, plaintext, ciphertext = KAT
+    return {name: aes(plaintext, key, False, name) == ciphertext and
+                  aes(ciphertext, key, True, name) == plaintext
+            for name in BACKENDS}
+
+
+# Description: Times count single-block encryptions for every backend
+#              with a fixed key schedule. Returns a dict of
+#              backend -> seconds per block.
+def benchmark(count = 1000, decrypt = False):
+    import time
+    key, plaintext, _ = KAT
+    results = {}
+
+    for name, (prepare, block) in BACKENDS.items():
+        schedule = prepare(key, decrypt)
+        start = time.perf_counter()
+        for i in range(count):
+            block(plaintext ^ i, schedule, decrypt)
+        results[name] = (time.perf_counter() - start) / count
+
+    return results
+
+
+if __name__ == "__main__":
+    print("\nAES Known-Answer Test (FIPS-197 C.1)")
+    print("------------------------------------")
+    for name, passed in selfTest().items():
+        print(name, "PASS" if passed else "FAIL")
 
+    print("\nSeconds per block")
+    print("-----------------")
+    for name, seconds in benchmark().items():
+        print(name, seconds)
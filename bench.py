@@ -0,0 +1,210 @@
+# Description: Known-answer checks and benchmarks for every primitive
+#              in the project. The known-answer vectors are checked
+#              first; then each case is timed and its throughput and
+#              latency percentiles are written to JSON and compared
+#              against a stored baseline.
+# Note:        Run as a script; see --help. The exit status is 1 if a
+#              known-answer check fails or a case regressed by more
+#              than the threshold.
+
+import aes
+import des
+import modes
+import prng
+import rsaKey
+import viginere
+
+# Used for timing, reports and the command line
+import argparse
+import json
+import os
+import sys
+import time
+
+# Default seconds spent timing each case
+DURATION = 0.5
+
+# Default allowed slowdown against the baseline (fraction)
+THRESHOLD = 0.10
+
+
+# Description: Checks the FIPS-197, FIPS-46, SP 800-38A and RFC 6229
+#              vectors on every engine. Returns a dict of check -> bool.
+def knownAnswers():
+    results = {}
+
+    # FIPS-197 C.1 on every AES engine
+    for name, passed in aes.selfTest().items():
+        results["aes-" + name] = passed
+    key, plaintext, ciphertext = aes.KAT
+    results["aes-object"] = aes.AES(key).encrypt(plaintext) == ciphertext
+    if(aes.np is not None):
+        block = aes.np.frombuffer(plaintext.to_bytes(16, "big"), aes.np.uint8)
+        results["aes-batch"] = aes.aesBatch(block, key).tobytes() == ciphertext.to_bytes(16, "big")
+
+    # SP 800-38A F.2.1 (CBC) and F.5.1 (CTR), first two blocks
+    cipher = aes.AES(0x2b7e151628aed2a6abf7158809cf4f3c)
+    data = bytes.fromhex("6bc1bee22e409f96e93d7e117393172aae2d8a571e03ac9c9eb76fac45af8e51")
+    cbc = b"".join(modes.encrypt(cipher, data, "CBC", bytes(range(16)), False))
+    ctr = b"".join(modes.encrypt(cipher, data, "CTR", 0xf0f1f2f3f4f5f6f7f8f9fafbfcfdfeff))
+    results["aes-cbc"] = cbc.hex() == "7649abac8119b246cee98e9b12e9197d5086cb9b507219ee95db113a917678b2"
+    results["aes-ctr"] = ctr.hex() == "874d6191b620e3261bef6864990db6ce9806f66b7970fdff8617187bb9fffdff"
+
+    # FIPS-46 worked example on every DES engine; 3DES with one key is DES
+    for name, passed in des.selfTest().items():
+        results["des-" + name] = passed
+    key, plaintext, ciphertext = des.KAT
+    results["des-bitsliced"] = des.encryptBatch([plaintext], key) == [ciphertext]
+    results["3des"] = (des.tripleEncrypt(plaintext, key, key) == ciphertext and
+                       des.tripleDecrypt(ciphertext, key, key) == plaintext)
+    results["3des-object"] = des.TripleDES(key, key).encrypt(plaintext) == ciphertext
+
+    # RFC 6229, key 0x0102030405, offsets 0 and 256
+    stream = prng.RC4Stream(bytes([1, 2, 3, 4, 5])).keystream(264)
+    results["rc4"] = stream[:8].hex() == "b2396305f03dc027"
+    results["rc4-drop"] = prng.RC4Stream(bytes([1, 2, 3, 4, 5]), drop = 256).keystream(8) == stream[256:]
+
+    # Miller-Rabin on known primes and Carmichael numbers
+    results["miller-rabin"] = (all(rsaKey.MillerRabin(p) for p in (2, 3, 65537, 2**127 - 1)) and
+                               not any(rsaKey.MillerRabin(n) for n in (1, 561, 41041, 2**128 + 1)))
+
+    return results
+
+
+# Description: Calls fn repeatedly for about duration seconds (at
+#              least minimum times). Returns the latencies in seconds.
+def measure(fn, duration = DURATION, minimum = 5):
+    latencies = []
+    began = time.perf_counter()
+    while(len(latencies) < minimum or time.perf_counter() - began < duration):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+# Description: Summarizes latencies of an operation on size bytes
+#              (or blocks blocks): ops/sec, blocks/sec, MB/sec and the
+#              50th, 90th and 99th percentile latency in microseconds.
+def summarize(latencies, size = 0, blocks = 0):
+    ordered = sorted(latencies)
+    total = sum(ordered)
+    ops = len(ordered) / total
+    result = {"ops": len(ordered), "opsPerSecond": ops}
+    if(blocks):
+        result["blocksPerSecond"] = ops * blocks
+    if(size):
+        result["MBPerSecond"] = ops * size / 1e6
+    for p in (50, 90, 99):
+        result["p%dMicroseconds" % p] = ordered[min(len(ordered) - 1, len(ordered) * p // 100)] * 1e6
+    return result
+
+
+# Description: Returns the benchmark cases as a list of (name,
+#              function, bytes per call, blocks per call).
+def cases(sizes = (1 << 10, 1 << 16)):
+    key = aes.KAT[0]
+    cipher = aes.AES(key)
+    triple = des.TripleDES(0x0123456789ABCDEF, 0x23456789ABCDEF01, 0x456789ABCDEF0123)
+    rc4 = prng.RC4Stream(b"benchmark key")
+    block = bytearray(16)
+    text = (open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "text.txt"))
+            .read().upper().replace("\n", ""))
+    result = [
+        ("aes.aes", lambda: aes.aes(aes.KAT[1], key), 16, 1),
+        ("aes.aes reference", lambda: aes.aes(aes.KAT[1], key, False, "reference"), 16, 1),
+        ("aes.AES.encrypt", lambda: cipher.encrypt(aes.KAT[1]), 16, 1),
+        ("aes.AES.encryptInto", lambda: cipher.encryptInto(block, 0, block, 0), 16, 1),
+        ("des.encrypt", lambda: des.encrypt(des.KAT[1], des.KAT[0]), 8, 1),
+        ("des.encrypt reference", lambda: des.encrypt(des.KAT[1], des.KAT[0], backend = "reference"), 8, 1),
+        ("des.tripleEncrypt", lambda: des.tripleEncrypt(des.KAT[1], 1, 2, 3), 8, 1),
+        ("des.TripleDES.encrypt", lambda: triple.encrypt(des.KAT[1]), 8, 1),
+        ("des.TripleDES.encryptInto", lambda: triple.encryptInto(block, 0, block, 0), 8, 1),
+    ]
+
+    for size in sizes:
+        data = os.urandom(size)
+        letters = (text * (size // len(text) + 1))[:size]
+        result += [
+            ("modes CTR %d" % size, lambda d = data: list(modes.encrypt(cipher, d, "CTR", 0)), size, size // 16),
+            ("modes ECB %d" % size, lambda d = data: list(modes.encrypt(cipher, d, "ECB", padding = False)), size, size // 16),
+            ("des.encryptBatch %d" % size, lambda d = data: des.encryptBatch(d, des.KAT[0]), size, size // 8),
+            ("prng.RC4Stream %d" % size, lambda n = size: rc4.keystream(n), size, 0),
+            ("prng.LCG %d" % size, lambda n = size: list(prng.LCG(1, n // 4)), size, 0),
+            ("viginere.getIoC %d" % size, lambda t = letters: viginere.getIoC(t), size, 0),
+        ]
+
+    for bits in (512, 1024):
+        prime = rsaKey.genPrime(bits)
+        result.append(("rsaKey.MillerRabin %d" % bits, lambda p = prime: rsaKey.MillerRabin(p), 0, 0))
+
+    primes = []
+    while(len(primes) < 2):
+        p = rsaKey.genPrime(256)
+        if(p % 4 == 3):
+            primes.append(p)
+    bbs = prng.BBSStream(3, *primes)
+    result.append(("prng.BBSStream 1024", lambda: bbs.read(1024), 1024, 0))
+    return result
+
+
+# Description: Times every case whose name contains one of filters
+#              (all cases if there are none). Returns a dict of
+#              name -> summary.
+def run(duration = DURATION, filters = ()):
+    results = {}
+    for name, fn, size, blocks in cases():
+        if(filters and not any(f in name for f in filters)):
+            continue
+        results[name] = summarize(measure(fn, duration), size, blocks)
+    return results
+
+
+# Description: Returns the cases whose ops/sec fell by more than
+#              threshold (a fraction) against baseline, as a dict of
+#              name -> {baseline, current, change}.
+def compare(results, baseline, threshold = THRESHOLD):
+    regressions = {}
+    for name, result in results.items():
+        if(name not in baseline):
+            continue
+        before = baseline[name]["opsPerSecond"]
+        after = result["opsPerSecond"]
+        if(after < before * (1 - threshold)):
+            regressions[name] = {"baseline": before, "current": after,
+                                 "change": after / before - 1}
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Known-answer checks and benchmarks")
+    parser.add_argument("--output", help = "write the results to this JSON file")
+    parser.add_argument("--baseline", help = "JSON results to compare against")
+    parser.add_argument("--save-baseline", action = "store_true",
+                        help = "write the results to --baseline instead of comparing")
+    parser.add_argument("--threshold", type = float, default = THRESHOLD,
+                        help = "allowed slowdown as a fraction (default 0.10)")
+    parser.add_argument("--duration", type = float, default = DURATION,
+                        help = "seconds per case")
+    parser.add_argument("filters", nargs = "*", help = "only run cases containing these")
+    args = parser.parse_args()
+
+    # Known answers first; timings of broken code are meaningless
+    report = {"knownAnswers": knownAnswers()}
+    if(not all(report["knownAnswers"].values())):
+        print(json.dumps(report, indent = 2))
+        sys.exit(1)
+
+    report["results"] = run(args.duration, args.filters)
+    if(args.baseline and args.save_baseline):
+        with open(args.baseline, "w") as f:
+            json.dump(report["results"], f, indent = 2)
+    elif(args.baseline):
+        with open(args.baseline) as f:
+            report["regressions"] = compare(report["results"], json.load(f), args.threshold)
+
+    if(args.output):
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent = 2)
+    print(json.dumps(report, indent = 2))
+    sys.exit(1 if report.get("regressions") else 0)
@@ -1,6 +1,15 @@
 # Contains all the DES tables (app for appendix)
 import app
 
+# Derived lookup tables shared through a cache file
+import tables
+
+# Block cipher modes for TripleDES streams
+import modes
+
+# Used to write blocks into buffers
+import struct
+
 # Description: Permutes (or expands/shrinks) the text via the bit
 #              placements designated in the box.
 def permute(text, box):
@@ -35,14 +44,26 @@ def keySchedule(key, rounds, decrypt):
     return subkeys[::-1] if decrypt else subkeys
 
 
-# Description: Returns text after one round of DES
-def desRound(text, subkey):
+# Description: Runs the eight S-boxes over the 48-bit expanded
+#              and keyed half. Returns the 32-bit output.
+def substitute(newR):
     temp = 0
 
     # Load the S-Boxes
     sBoxes = [app.S1, app.S2, app.S3, app.S4,
               app.S5, app.S6, app.S7, app.S8]
 
+    for j in range(8):
+        bits = (newR >> 6*(7-j)) & 0x3f #S-Box 6 bit input
+        sRow = 2*(bits >> 5) + (bits & 1) #Last and first bit
+        sColumn = (bits & 0x1e) >> 1 #Middle 4 bits
+        temp = (temp << 4) | sBoxes[j][sRow*16 + sColumn] #S-box output
+
+    return temp
+
+
+# Description: Returns text after one round of DES
+def desRound(text, subkey):
     #First 32 bits of text
     newL = text & 0xffffffff
 
@@ -50,11 +71,7 @@ def desRound(text, subkey):
     newR = permute(newL, app.E) ^ subkey
 
     #S-boxes
-    for j in range(8):
-        bits = (newR >> 6*(7-j)) & 0x3f #S-Box 6 bit input
-        sRow = 2*(bits >> 5) + (bits & 1) #Last and first bit
-        sColumn = (bits & 0x1e) >> 1 #Middle 4 bits
-        temp = (temp << 4) | sBoxes[j][sRow*16 + sColumn] #S-box output
+    temp = substitute(newR)
 
     #Permutation and XOR
     newR = permute(temp, app.P) ^ (text >> 32)
@@ -63,12 +80,9 @@ def desRound(text, subkey):
     return (newL << 32) | newR
 
 
-# Description: Takes in two 64-bit numbers (as plaintext and key)
-#              and applies the DEA. Returns the encrypted text.
-def encrypt(plaintext, key, rounds = 16, decrypt = False):
-    # Get key schedule
-    subkeys = keySchedule(key, rounds, decrypt)
-
+# Description: Runs the DEA on a 64-bit number with the bit-serial
+#              permute and S-box loop above.
+def referenceBlock(plaintext, subkeys, rounds = 16):
     #Initial Permutation
     ciphertext = permute(plaintext, app.IP)
 
@@ -81,11 +95,112 @@ def encrypt(plaintext, key, rounds = 16, decrypt = False):
     return permute(ciphertext, app.oIP)
 
 
+# Description: Same result as permute(text, box) given the tables
+#              built by tables.permuteTables(box), one per input byte.
+def tablePermute(text, tables):
+    result = 0
+    for table in tables:
+        result |= table[text & 0xff]
+        text >>= 8
+    return result
+
+
+# Description: Same as tablePermute but reads the text as big-endian
+#              bytes of src at offset, one lookup per byte.
+def bufferPermute(src, offset, tables):
+    result = 0
+    last = offset + len(tables) - 1
+    for k, table in enumerate(tables):
+        result |= table[src[last - k]]
+    return result
+
+
+# Writes a block as one big-endian 64-bit word
+BLOCK = struct.Struct(">Q")
+
+
+# Per-byte permutation tables and SP-boxes (S-boxes merged with P)
+# from the table cache, copied into lists
+IP = tables.lists("IP")
+oIP = tables.lists("oIP")
+E = tables.lists("E")
+PC1 = tables.lists("PC1")
+PC2 = tables.lists("PC2")
+SP = tables.lists("SP")
+
+
+# Description: Same as keySchedule but with the permutation tables.
+def tableKeySchedule(key, rounds, decrypt):
+    subkeys = []
+    key = tablePermute(key, PC1)
+
+    for i in range(rounds):
+        L = key >> 28
+        R = key & 0xfffffff
+        L = ((L << app.LS[i]) + (L >> (28 - app.LS[i]))) & 0xfffffff
+        R = ((R << app.LS[i]) + (R >> (28 - app.LS[i]))) & 0xfffffff
+        key = (L << 28) | R
+        subkeys.append(tablePermute(key, PC2))
+
+    return subkeys[::-1] if decrypt else subkeys
+
+
+# Description: Runs the DEA with the permutation tables and SP-boxes
+#              on the 8 bytes of src at srcOffset and writes the result
+#              into dst at dstOffset (dst may be src). A round is 4
+#              expansion lookups and 8 SP-box lookups.
+def tableBlockInto(src, srcOffset, dst, dstOffset, subkeys, rounds = 16):
+    E0, E1, E2, E3 = E
+    SP1, SP2, SP3, SP4, SP5, SP6, SP7, SP8 = SP
+
+    #Initial Permutation
+    text = bufferPermute(src, srcOffset, IP)
+    L = text >> 32
+    R = text & 0xffffffff
+
+    #DES Rounds
+    for i in range(rounds):
+        x = (E0[R & 0xff] | E1[(R >> 8) & 0xff] |
+             E2[(R >> 16) & 0xff] | E3[R >> 24]) ^ subkeys[i]
+        L, R = R, L ^ (SP1[x >> 42] | SP2[(x >> 36) & 0x3f] |
+                       SP3[(x >> 30) & 0x3f] | SP4[(x >> 24) & 0x3f] |
+                       SP5[(x >> 18) & 0x3f] | SP6[(x >> 12) & 0x3f] |
+                       SP7[(x >> 6) & 0x3f] | SP8[x & 0x3f])
+
+    #Flip and Inverse Initial Permutation
+    BLOCK.pack_into(dst, dstOffset, tablePermute((R << 32) | L, oIP))
+
+
+# Description: Runs the DEA on a 64-bit number with the tables (a
+#              wrapper around tableBlockInto).
+def tableBlock(plaintext, subkeys, rounds = 16):
+    block = bytearray(plaintext.to_bytes(8, "big"))
+    tableBlockInto(block, 0, block, 0, subkeys, rounds)
+    return int.from_bytes(block, "big")
+
+
+# Available block engines as (key schedule, block function) pairs.
+BACKENDS = {"reference": (keySchedule, referenceBlock),
+            "table": (tableKeySchedule, tableBlock)}
+
+# Engine used by encrypt when no backend is given.
+BACKEND = "table"
+
+
+# Description: Takes in two 64-bit numbers (as plaintext and key)
+#              and applies the DEA. Returns the encrypted text.
+# Note:        backend selects an entry of BACKENDS and defaults to
+#              the module-level BACKEND.
+def encrypt(plaintext, key, rounds = 16, decrypt = False, backend = None):
+    schedule, block = BACKENDS[backend or BACKEND]
+    return block(plaintext, schedule(key, rounds, decrypt), rounds)
+
+
 # Description: Same algorithm as encryption but with reversed
 #              key schedule. Placed in its own function for
 #              convenience and clarity purposes.
-def decrypt(ciphertext, key, rounds = 16):
-    return encrypt(ciphertext, key, rounds, True)
+def decrypt(ciphertext, key, rounds = 16, backend = None):
+    return encrypt(ciphertext, key, rounds, True, backend)
 
 
 # Description: Takes in two 64 bits numbers (as plaintext and key)
@@ -103,4 +218,270 @@ def tripleEncrypt(plaintext, key1, key2, key3 = False):
 #              decrypt(encrypt(decrypt))
 def tripleDecrypt(ciphertext, key1, key2, key3 = False):
     if(not key3): key3 = key1
-    return decrypt(encrypt(decrypt(plaintext, key3), key2), key1) 
+    return decrypt(encrypt(decrypt(ciphertext, key3), key2), key1)
+
+
+# Description: Runs 3DES on the 8 bytes of src at srcOffset, writing
+#              into dst at dstOffset, given the three subkey lists in
+#              the order they are applied. The oIP/IP pairs
+#              between stages cancel out, so only the outer ones are
+#              done and each inner stage just swaps the halves.
+def tripleBlockInto(src, srcOffset, dst, dstOffset, schedules, rounds = 16):
+    E0, E1, E2, E3 = E
+    SP1, SP2, SP3, SP4, SP5, SP6, SP7, SP8 = SP
+
+    text = bufferPermute(src, srcOffset, IP)
+    L = text >> 32
+    R = text & 0xffffffff
+
+    for subkeys in schedules:
+        for i in range(rounds):
+            x = (E0[R & 0xff] | E1[(R >> 8) & 0xff] |
+                 E2[(R >> 16) & 0xff] | E3[R >> 24]) ^ subkeys[i]
+            L, R = R, L ^ (SP1[x >> 42] | SP2[(x >> 36) & 0x3f] |
+                           SP3[(x >> 30) & 0x3f] | SP4[(x >> 24) & 0x3f] |
+                           SP5[(x >> 18) & 0x3f] | SP6[(x >> 12) & 0x3f] |
+                           SP7[(x >> 6) & 0x3f] | SP8[x & 0x3f])
+        L, R = R, L
+
+    BLOCK.pack_into(dst, dstOffset, tablePermute((L << 32) | R, oIP))
+
+
+# Description: tripleBlockInto on a 64-bit number.
+def tripleBlock(text, schedules, rounds = 16):
+    block = bytearray(text.to_bytes(8, "big"))
+    tripleBlockInto(block, 0, block, 0, schedules, rounds)
+    return int.from_bytes(block, "big")
+
+
+# Description: A triple DES cipher bound to one key bundle. All the
+#              key schedules (forward and reversed) are built once on
+#              creation, so blocks and streams need no schedule work.
+# Note:        As with tripleEncrypt, key3 defaults to key1.
+class TripleDES:
+    blockSize = 8
+
+    def __init__(self, key1, key2, key3 = False, rounds = 16):
+        if(not key3): key3 = key1
+        self.rounds = rounds
+        k1, k2, k3 = [tableKeySchedule(k, rounds, False) for k in (key1, key2, key3)]
+
+        # encrypt(decrypt(encrypt)) and decrypt(encrypt(decrypt))
+        self.encryptSchedules = (tuple(k1), tuple(k2[::-1]), tuple(k3))
+        self.decryptSchedules = (tuple(k3[::-1]), tuple(k2), tuple(k1[::-1]))
+
+    # Description: Encrypts one 64-bit integer block.
+    def encrypt(self, plaintext):
+        return tripleBlock(plaintext, self.encryptSchedules, self.rounds)
+
+    # Description: Decrypts one 64-bit integer block.
+    def decrypt(self, ciphertext):
+        return tripleBlock(ciphertext, self.decryptSchedules, self.rounds)
+
+    # Description: Encrypts (or decrypts) the block of src at srcOffset
+    #              into dst at dstOffset, without int conversions.
+    def encryptInto(self, src, srcOffset, dst, dstOffset):
+        tripleBlockInto(src, srcOffset, dst, dstOffset, self.encryptSchedules, self.rounds)
+
+    def decryptInto(self, src, srcOffset, dst, dstOffset):
+        tripleBlockInto(src, srcOffset, dst, dstOffset, self.decryptSchedules, self.rounds)
+
+    # Description: Encrypts a byte stream (see modes.encrypt).
+    def encryptStream(self, source, mode = "CBC", iv = None, padding = True):
+        return modes.encrypt(self, source, mode, iv, padding)
+
+    # Description: Decrypts a byte stream (see modes.decrypt).
+    def decryptStream(self, source, mode = "CBC", iv = None, padding = True):
+        return modes.decrypt(self, source, mode, iv, padding)
+
+
+##### BITSLICED DES #####
+
+# Description: For each S-box and output bit, the 6-bit inputs for
+#              which that output bit is set. Used to build the S-box
+#              circuits from the decoder outputs in sliceSBox.
+def sliceTerms():
+    sBoxes = [app.S1, app.S2, app.S3, app.S4,
+              app.S5, app.S6, app.S7, app.S8]
+    terms = []
+    for box in sBoxes:
+        outputs = [[] for b in range(4)]
+        for bits in range(64):
+            value = box[32*(bits >> 5) + 16*(bits & 1) + ((bits & 0x1e) >> 1)]
+            for b in range(4):
+                if((value >> b) & 1):
+                    outputs[b].append(bits)
+        terms.append(outputs)
+    return terms
+
+SLICE_TERMS = sliceTerms()
+
+
+# Description: Evaluates S-box j as a boolean circuit on bit-slices.
+#              inputs holds the 6 input slices (bit 0 first); returns
+#              the 4 output slices (bit 0 first). The circuit is a
+#              6-to-64 decoder (126 ANDs) followed by one OR tree per
+#              output bit.
+def sliceSBox(j, inputs, mask):
+    selects = [mask]
+    for b in range(6):
+        v = inputs[b]
+        nv = v ^ mask
+        selects = [t & nv for t in selects] + [t & v for t in selects]
+
+    outputs = []
+    for term in SLICE_TERMS[j]:
+        out = 0
+        for bits in term:
+            out |= selects[bits]
+        outputs.append(out)
+    return outputs
+
+
+# Description: Permutes a list of bit-slices (bit 0 first) with box,
+#              the bitsliced equivalent of permute.
+def slicePermute(slices, box):
+    n = len(box)
+    out = [0]*n
+    for i in range(n):
+        out[n - 1 - i] = slices[box[i]]
+    return out
+
+
+# Description: Transposes blocks (64-bit ints) into 64 bit-slices.
+#              Bit k of slice i (counting from the most significant)
+#              is bit i of block k.
+def toSlices(blocks):
+    columns = zip(*[format(block, "064b") for block in blocks])
+    return [int("".join(column), 2) for column in columns][::-1]
+
+
+# Description: Inverse of toSlices for count blocks.
+def fromSlices(slices, count):
+    rows = zip(*[format(s, "0%db" % count) for s in slices[::-1]])
+    return [int("".join(row), 2) for row in rows]
+
+
+# Description: Runs the DEA on every block in blocks at once, with
+#              each bit position held as one integer lane across all
+#              blocks. Same parameters and results as encrypt.
+def sliceBlocks(blocks, subkeys, rounds):
+    mask = (1 << len(blocks)) - 1
+    text = slicePermute(toSlices(blocks), app.IP)
+    R, L = text[:32], text[32:]
+
+    for i in range(rounds):
+        # Expansion and key XOR (a set key bit inverts the slice)
+        x = slicePermute(R, app.E)
+        for b in range(48):
+            if((subkeys[i] >> b) & 1):
+                x[b] ^= mask
+
+        # S-boxes then P
+        temp = [0]*32
+        for j in range(8):
+            temp[4*(7-j):4*(7-j) + 4] = sliceSBox(j, x[6*(7-j):6*(7-j) + 6], mask)
+        f = slicePermute(temp, app.P)
+        L, R = R, [L[b] ^ f[b] for b in range(32)]
+
+    return fromSlices(slicePermute(L + R, app.oIP), len(blocks))
+
+
+# Default number of blocks evaluated together by encryptBatch
+BATCH_WIDTH = 1 << 12
+
+
+# Description: Encrypts (or decrypts) many blocks with the bitsliced
+#              engine. blocks is either a list of 64-bit ints (returns
+#              a list of ints) or bytes holding whole 8-byte blocks
+#              (returns bytes). Blocks are processed width at a time.
+def encryptBatch(blocks, key, rounds = 16, decrypt = False, width = BATCH_WIDTH):
+    subkeys = tableKeySchedule(key, rounds, decrypt)
+    raw = isinstance(blocks, (bytes, bytearray, memoryview))
+    if(raw):
+        data = bytes(blocks)
+        if(len(data) % 8):
+            raise ValueError("Input is not a multiple of the block size")
+        blocks = [int.from_bytes(data[i:i + 8], "big") for i in range(0, len(data), 8)]
+
+    result = []
+    for i in range(0, len(blocks), width):
+        result += sliceBlocks(blocks[i:i + width], subkeys, rounds)
+
+    if(raw):
+        return b"".join(block.to_bytes(8, "big") for block in result)
+    return result
+
+
+# Description: Decrypts many blocks with the bitsliced engine.
+def decryptBatch(blocks, key, rounds = 16, width = BATCH_WIDTH):
+    return encryptBatch(blocks, key, rounds, True, width)
+
+
+# Description: Compares the throughput of the scalar table engine and
+#              the bitsliced engine on count blocks. Returns a dict of
+#              engine -> blocks per second.
+def benchmarkBatch(count = 1 << 12, rounds = 16, width = BATCH_WIDTH):
+    import time
+    key, plaintext, _ = KAT
+    blocks = [plaintext ^ i for i in range(count)]
+    subkeys = tableKeySchedule(key, rounds, False)
+
+    start = time.perf_counter()
+    for block in blocks:
+        tableBlock(block, subkeys, rounds)
+    scalar = time.perf_counter() - start
+
+    start = time.perf_counter()
+    encryptBatch(blocks, key, rounds, False, width)
+    sliced = time.perf_counter() - start
+
+    return {"table": count / scalar, "bitsliced": count / sliced}
+
+
+# FIPS-46 worked example (key, plaintext, ciphertext)
+KAT = (0x133457799BBCDFF1, 0x0123456789ABCDEF, 0x85E813540F0AB405)
+
+
+# Description: Checks every backend against the known-answer vector
+#              in both directions. Returns a dict of backend -> bool.
+def selfTest():
+    key, plaintext, ciphertext = KAT
+    return {name: encrypt(plaintext, key, backend = name) == ciphertext and
+                  decrypt(ciphertext, key, backend = name) == plaintext
+            for name in BACKENDS}
+
+
+# Description: Times count single-block encryptions for every backend
+#              with a fixed key schedule. Returns a dict of
+#              backend -> seconds per block.
+def benchmark(count = 1000, rounds = 16):
+    import time
+    key, plaintext, _ = KAT
+    results = {}
+
+    for name, (schedule, block) in BACKENDS.items():
+        subkeys = schedule(key, rounds, False)
+        start = time.perf_counter()
+        for i in range(count):
+            block(plaintext ^ i, subkeys, rounds)
+        results[name] = (time.perf_counter() - start) / count
+
+    return results
+
+
+if __name__ == "__main__":
+    print("\nDES Known-Answer Test")
+    print("---------------------")
+    for name, passed in selfTest().items():
+        print(name, "PASS" if passed else "FAIL")
+
+    print("\nSeconds per block")
+    print("-----------------")
+    for name, seconds in benchmark().items():
+        print(name, seconds)
+
+    print("\nBlocks per second")
+    print("-----------------")
+    for name, rate in benchmarkBatch().items():
+        print(name, rate)
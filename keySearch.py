@@ -0,0 +1,161 @@
+# Description: Exhaustive key search against (reduced-round) DES
+#              for known plaintext/ciphertext pairs, split across a
+#              pool of worker processes with checkpoint and resume.
+# Note:        The searched keys are base with every combination of
+#              the bits in mask filled in. Candidate i sets the mask
+#              bits to the bits of i (lowest mask bit first), so a
+#              range of candidates is just a range of integers.
+# Note:        DES ignores the lowest bit of every key byte (parity),
+#              so leaving those out of mask halves the work per bit.
+
+# DES table engine used for candidate checks
+import des
+
+# Used for the worker pool, checkpoints and timing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import json
+import os
+import time
+
+# Default number of candidates handed to a worker at a time
+CHUNK_SIZE = 1 << 14
+
+
+# Description: Returns the positions of the set bits in mask.
+def maskBits(mask):
+    return [b for b in range(64) if((mask >> b) & 1)]
+
+
+# Description: Returns the key for candidate index under the mask
+#              bit positions given by bits.
+def candidateKey(index, base, bits):
+    key = base
+    for b in bits:
+        if(index & 1):
+            key |= 1 << b
+        index >>= 1
+    return key
+
+
+# Description: Tests candidates [start, stop) in a worker process.
+#              Every key is first checked against the first pair and
+#              only survivors are checked against the rest. Returns
+#              (start, keys found, candidates tested, seconds, pid).
+def searchChunk(pairs, base, mask, rounds, start, stop):
+    bits = maskBits(mask)
+    base &= ~mask
+    plaintext, ciphertext = pairs[0]
+    found = []
+    began = time.perf_counter()
+
+    for index in range(start, stop):
+        key = candidateKey(index, base, bits)
+        subkeys = des.tableKeySchedule(key, rounds, False)
+
+        # Early rejection on the first pair
+        if(des.tableBlock(plaintext, subkeys, rounds) != ciphertext):
+            continue
+        if(all(des.tableBlock(p, subkeys, rounds) == c for p, c in pairs[1:])):
+            found.append(key)
+
+    return start, found, stop - start, time.perf_counter() - began, os.getpid()
+
+
+# Description: Loads the checkpoint at path if it exists and belongs
+#              to the same search (same params). Returns the stored
+#              state or a fresh one.
+def loadCheckpoint(path, params):
+    state = {"params": params, "done": [], "found": [], "workers": {}}
+    if(path and os.path.exists(path)):
+        with open(path) as f:
+            saved = json.load(f)
+        if(saved["params"] != params):
+            raise ValueError("Checkpoint %s is for a different search" % path)
+        state = saved
+    return state
+
+
+# Description: Atomically writes the search state to path.
+def saveCheckpoint(path, state):
+    if(path):
+        with open(path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(path + ".tmp", path)
+
+
+# Description: Searches for the DES keys (with the given number of
+#              rounds) that map every plaintext in pairs to its
+#              ciphertext. Candidates [start, stop) are split into
+#              chunks of chunkSize and spread over workers processes.
+#              stop defaults to the whole mask space.
+# Note:        With a checkpoint path, progress is saved after every
+#              chunk and an interrupted search with the same
+#              parameters resumes where it stopped.
+# Note:        Returns a dict with the matching keys and per-worker
+#              statistics (candidates, seconds and keys per second).
+def search(pairs, mask, base = 0, rounds = 16, start = 0, stop = None,
+           workers = None, chunkSize = CHUNK_SIZE, checkpoint = None,
+           stopOnFirst = False):
+    pairs = [tuple(pair) for pair in pairs]
+    stop = 1 << len(maskBits(mask)) if stop is None else stop
+    params = {"pairs": pairs, "mask": mask, "base": base & ~mask,
+              "rounds": rounds, "start": start, "stop": stop,
+              "chunkSize": chunkSize}
+    state = loadCheckpoint(checkpoint, json.loads(json.dumps(params)))
+    done = set(state["done"])
+    todo = (s for s in range(start, stop, chunkSize) if s not in done)
+    workers = workers or os.cpu_count()
+    pending = set()
+
+    with ProcessPoolExecutor(workers) as pool:
+        while(True):
+            # Keep two chunks per worker in flight
+            if(not (stopOnFirst and state["found"])):
+                for s in todo:
+                    pending.add(pool.submit(searchChunk, pairs, base, mask, rounds,
+                                            s, min(s + chunkSize, stop)))
+                    if(len(pending) >= 2*workers):
+                        break
+            if(not pending):
+                break
+
+            finished, pending = wait(pending, return_when = FIRST_COMPLETED)
+            for future in finished:
+                s, found, tested, seconds, pid = future.result()
+                stats = state["workers"].setdefault(str(pid), [0, 0.0])
+                stats[0] += tested
+                stats[1] += seconds
+                state["done"].append(s)
+                state["found"] += found
+            saveCheckpoint(checkpoint, state)
+
+        for future in pending:
+            future.cancel()
+
+    return {"keys": sorted(set(state["found"])),
+            "complete": len(state["done"]) == len(range(start, stop, chunkSize)),
+            "workers": {pid: {"candidates": n, "seconds": t,
+                              "keysPerSecond": n / t if t else 0.0}
+                        for pid, (n, t) in state["workers"].items()}}
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description = "Reduced-round DES key search")
+    parser.add_argument("pairs", nargs = "+", help = "plaintext:ciphertext in hex")
+    parser.add_argument("--mask", required = True, help = "key bits to search (hex)")
+    parser.add_argument("--base", default = "0", help = "fixed key bits (hex)")
+    parser.add_argument("--rounds", type = int, default = 16)
+    parser.add_argument("--start", type = int, default = 0)
+    parser.add_argument("--stop", type = int)
+    parser.add_argument("--workers", type = int)
+    parser.add_argument("--chunk-size", type = int, default = CHUNK_SIZE)
+    parser.add_argument("--checkpoint")
+    parser.add_argument("--first", action = "store_true", help = "stop at the first key")
+    args = parser.parse_args()
+
+    pairs = [[int(x, 16) for x in pair.split(":")] for pair in args.pairs]
+    result = search(pairs, int(args.mask, 16), int(args.base, 16), args.rounds,
+                    args.start, args.stop, args.workers, args.chunk_size,
+                    args.checkpoint, args.first)
+    print(json.dumps(result, indent = 2))
@@ -0,0 +1,231 @@
+# Description: Modular exponentiation with per-key precomputation:
+#              a Montgomery context per modulus (kept in an LRU cache),
+#              sliding-window plans for fixed exponents and comb
+#              tables for fixed bases.
+# Note:        Only FixedBase beats the builtin pow. FixedExponent is a
+#              pure Python reference of the sliding-window method and
+#              is slower than pow; nothing in rsaKey uses this module.
+
+# Used for the context cache
+from collections import OrderedDict
+import random
+import time
+
+
+# Description: Montgomery arithmetic mod an odd n with R = 2^bits.
+#              Numbers in Montgomery form are stored as a*R mod n, so
+#              a product is reduced with shifts and masks instead of
+#              a division by n.
+class ModContext:
+    def __init__(self, n):
+        if(not n % 2):
+            raise ValueError("Montgomery reduction needs an odd modulus")
+        self.n = n
+        self.bits = n.bit_length()
+        self.mask = (1 << self.bits) - 1
+        self.nPrime = -pow(n, -1, 1 << self.bits) & self.mask
+        self.one = (1 << self.bits) % n
+        self.r2 = (1 << 2*self.bits) % n
+
+    # Description: Montgomery reduction of t < n*R: returns t/R mod n.
+    def reduce(self, t):
+        m = ((t & self.mask) * self.nPrime) & self.mask
+        t = (t + m * self.n) >> self.bits
+        return t - self.n if t >= self.n else t
+
+    # Description: Converts into and out of Montgomery form.
+    def toMont(self, a):
+        return self.reduce((a % self.n) * self.r2)
+
+    def fromMont(self, a):
+        return self.reduce(a)
+
+    # Description: Multiplies two numbers in Montgomery form.
+    def mul(self, a, b):
+        return self.reduce(a * b)
+
+
+# Description: A bounded least-recently-used cache of ModContexts
+#              keyed by modulus, with hit/miss counters.
+class ContextCache:
+    def __init__(self, maxsize = 64):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = self.misses = 0
+
+    # Description: Returns the context for n, creating it if needed.
+    def get(self, n):
+        context = self.entries.get(n)
+        if(context is not None):
+            self.hits += 1
+            self.entries.move_to_end(n)
+            return context
+
+        self.misses += 1
+        context = self.entries[n] = ModContext(n)
+        if(len(self.entries) > self.maxsize):
+            self.entries.popitem(last = False)
+        return context
+
+    # Description: Returns the cache counters as a dict.
+    def info(self):
+        return {"hits": self.hits, "misses": self.misses,
+                "size": len(self.entries), "maxsize": self.maxsize}
+
+
+# Context cache shared by FixedExponent and FixedBase.
+contextCache = ContextCache()
+
+
+# Description: Splits exponent into sliding windows of at most
+#              window bits. Returns a list of (squarings, digit)
+#              steps, read from the most significant end, where digit
+#              is an odd window value (or 0 for trailing squarings).
+def slidingWindows(exponent, window):
+    bits = bin(exponent)[2:]
+    steps = []
+    i = 0
+    squarings = 0
+
+    while(i < len(bits)):
+        if(bits[i] == "0"):
+            squarings += 1
+            i += 1
+            continue
+
+        # Longest window starting here that ends in a 1
+        j = min(i + window, len(bits))
+        while(bits[j - 1] == "0"):
+            j -= 1
+        steps.append((squarings + j - i, int(bits[i:j], 2)))
+        squarings = 0
+        i = j
+
+    if(squarings):
+        steps.append((squarings, 0))
+    return steps
+
+
+# Description: Raises many bases to one fixed exponent mod n. The
+#              sliding-window plan is built once per exponent; each
+#              power then only needs the odd powers of its base.
+# Note:        Reference only, not an acceleration: CPython's builtin
+#              pow runs the same sliding-window loop in C and is about
+#              1.5x faster (see benchmark). Use pow (or RSAKey's CRT)
+#              for real work.
+class FixedExponent:
+    def __init__(self, exponent, n, window = 5, cache = contextCache):
+        self.exponent = exponent
+        self.context = cache.get(n)
+        self.window = window
+        self.steps = slidingWindows(exponent, window)
+
+    # Description: Returns base^exponent mod n.
+    def power(self, base):
+        ctx = self.context
+        reduce = ctx.reduce
+        b = ctx.toMont(base)
+
+        # Odd powers b, b^3, ..., b^(2^window - 1) (index digit // 2)
+        b2 = reduce(b * b)
+        odd = [b]
+        for i in range((1 << (self.window - 1)) - 1):
+            odd.append(reduce(odd[-1] * b2))
+
+        result = ctx.one
+        for squarings, digit in self.steps:
+            for i in range(squarings):
+                result = reduce(result * result)
+            if(digit):
+                result = reduce(result * odd[digit >> 1])
+        return ctx.fromMont(result)
+
+    # Description: power over a list of bases.
+    def powerBatch(self, bases):
+        return [self.power(base) for base in bases]
+
+
+# Description: Raises one fixed base to many exponents mod n using a
+#              comb of precomputed powers base^(j * 2^(window*i)), so
+#              a power costs one multiplication per window and no
+#              squarings at all.
+class FixedBase:
+    def __init__(self, base, n, maxBits = None, window = 4, cache = contextCache):
+        self.context = ctx = cache.get(n)
+        self.window = window
+        self.maxBits = maxBits or n.bit_length()
+
+        # table[i][j] = base^(j * 2^(window*i)) in Montgomery form
+        self.table = []
+        b = ctx.toMont(base)
+        for i in range(-(-self.maxBits // window)):
+            row = [ctx.one, b]
+            for j in range(2, 1 << window):
+                row.append(ctx.mul(row[-1], b))
+            self.table.append(row)
+            b = ctx.mul(row[-1], b)
+
+    # Description: Returns base^exponent mod n.
+    def power(self, exponent):
+        if(exponent.bit_length() > self.maxBits):
+            raise ValueError("Exponent is larger than maxBits")
+        ctx = self.context
+        reduce = ctx.reduce
+        mask = (1 << self.window) - 1
+        result = ctx.one
+
+        for row in self.table:
+            digit = exponent & mask
+            if(digit):
+                result = reduce(result * row[digit])
+            exponent >>= self.window
+        return ctx.fromMont(result)
+
+
+# Description: Measures ops/sec of builtin pow against the fixed
+#              exponent reference and the fixed base engine for each
+#              modulus size, with full-size random exponents. Returns a
+#              dict of bits -> {engine: ops/sec}.
+def benchmark(sizes = (1024, 2048), count = 20):
+    results = {}
+
+    for bits in sizes:
+        n = random.getrandbits(bits) | (1 << (bits - 1)) | 1
+        exponent = random.getrandbits(bits) % n
+        bases = [random.getrandbits(bits) % n for i in range(count)]
+        fixedExponent = FixedExponent(exponent, n)
+        fixedBase = FixedBase(bases[0], n)
+        timings = {}
+
+        start = time.perf_counter()
+        for base in bases:
+            pow(base, exponent, n)
+        timings["pow"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for base in bases:
+            fixedExponent.power(base)
+        timings["fixedExponentReference"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i in range(count):
+            pow(bases[0], exponent ^ i, n)
+        timings["powFixedBase"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i in range(count):
+            fixedBase.power(exponent ^ i)
+        timings["fixedBase"] = time.perf_counter() - start
+
+        results[bits] = {name: count / t for name, t in timings.items()}
+
+    return results
+
+
+if __name__ == "__main__":
+    print("\nModular exponentiation (ops/sec)")
+    print("--------------------------------")
+    print("(fixedExponentReference is a reference and loses to pow)")
+    for bits, rates in benchmark().items():
+        for name, rate in rates.items():
+            print(bits, name, rate)
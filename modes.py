@@ -0,0 +1,352 @@
+# Description: Block cipher modes of operation (ECB, CBC, CTR) with
+#              PKCS#7 padding, over bytes, memoryviews, file objects
+#              or iterators of chunks.
+# Note:        A cipher is any object with a blockSize attribute (in
+#              bytes) and encrypt/decrypt methods that take and return
+#              one block as an integer, such as aes.AES.
+# Note:        Input is consumed chunk by chunk and at most one chunk
+#              plus one block is held at a time, so memory use does
+#              not depend on the size of the input.
+
+# Used to run segments on several cores and to time them
+from concurrent.futures import ProcessPoolExecutor
+import os
+import time
+
+MODES = ("ECB", "CBC", "CTR")
+
+# Default size of the chunks read from bytes and file inputs
+CHUNK_SIZE = 1 << 16
+
+
+# Description: Splits source into an iterator of bytes-like chunks.
+#              bytes, bytearray and memoryview inputs are sliced
+#              without copying, file objects are read chunkSize bytes
+#              at a time and anything else is iterated as is.
+def chunks(source, chunkSize = CHUNK_SIZE):
+    if(isinstance(source, (bytes, bytearray, memoryview))):
+        view = memoryview(source).cast("B")
+        return (view[i:i + chunkSize] for i in range(0, len(view), chunkSize))
+    if(hasattr(source, "read")):
+        return iter(lambda: source.read(chunkSize), b"")
+    return iter(source)
+
+
+# Description: Adds PKCS#7 padding to the final (partial) block.
+def pad(data, blockSize):
+    n = blockSize - len(data) % blockSize
+    return bytes(data) + bytes([n])*n
+
+
+# Description: Removes PKCS#7 padding from the final block(s).
+def unpad(data, blockSize):
+    n = data[-1] if data else 0
+    if(not 0 < n <= blockSize or data[-n:] != bytes([n])*n):
+        raise ValueError("Invalid PKCS#7 padding")
+    return data[:-n]
+
+
+# Description: Converts an IV or initial counter given as an int or
+#              bytes into an int.
+def toBlock(value, blockSize):
+    if(isinstance(value, int)):
+        return value
+    if(len(value) != blockSize):
+        raise ValueError("IV must be %d bytes" % blockSize)
+    return int.from_bytes(value, "big")
+
+
+# Description: Returns a function that runs the given mode over data
+#              and writes the result into out at offset. ECB and CBC
+#              need whole blocks; CTR accepts a partial final block.
+#              The returned function keeps the chaining value (or
+#              counter) between calls.
+# Note:        ECB uses the cipher's encryptInto/decryptInto when it
+#              has them, so blocks go straight from data into out.
+def blockFunction(cipher, mode, iv, decrypt):
+    n = cipher.blockSize
+    mask = (1 << 8*n) - 1
+
+    if(mode not in MODES):
+        raise ValueError("Unknown mode: %s" % mode)
+    if(mode != "ECB" and iv is None):
+        raise ValueError("%s mode needs an IV" % mode)
+
+    if(mode == "ECB" and hasattr(cipher, "encryptInto")):
+        f = cipher.decryptInto if decrypt else cipher.encryptInto
+        def process(data, out, offset):
+            for i in range(0, len(data), n):
+                f(data, i, out, offset + i)
+
+    elif(mode == "ECB"):
+        f = cipher.decrypt if decrypt else cipher.encrypt
+        def process(data, out, offset):
+            for i in range(0, len(data), n):
+                block = f(int.from_bytes(data[i:i + n], "big"))
+                out[offset + i:offset + i + n] = block.to_bytes(n, "big")
+
+    elif(mode == "CBC"):
+        state = [toBlock(iv, n)]
+        def process(data, out, offset):
+            previous = state[0]
+            for i in range(0, len(data), n):
+                block = int.from_bytes(data[i:i + n], "big")
+                if(decrypt):
+                    result = cipher.decrypt(block) ^ previous
+                    previous = block
+                else:
+                    result = previous = cipher.encrypt(block ^ previous)
+                out[offset + i:offset + i + n] = result.to_bytes(n, "big")
+            state[0] = previous
+
+    else:
+        state = [toBlock(iv, n)]
+        def process(data, out, offset):
+            counter = state[0]
+            for i in range(0, len(data), n):
+                block = data[i:i + n]
+                size = len(block)
+                stream = cipher.encrypt(counter) >> 8*(n - size)
+                result = int.from_bytes(block, "big") ^ stream
+                out[offset + i:offset + i + size] = result.to_bytes(size, "big")
+                counter = (counter + 1) & mask
+            state[0] = counter
+
+    return process
+
+
+# Description: Generator behind encrypt and decrypt. Yields one
+#              bytearray per input chunk (less any bytes held back
+#              to complete a block or to strip padding).
+def stream(cipher, source, mode, iv, padding, decrypt, chunkSize):
+    n = cipher.blockSize
+    process = blockFunction(cipher, mode, iv, decrypt)
+    padding = padding and mode != "CTR"
+    carry = b""
+
+    for chunk in chunks(source, chunkSize):
+        if(carry):
+            chunk = bytes(carry) + bytes(chunk)
+        size = len(chunk) - len(chunk) % n
+
+        # Hold back the last full block for unpadding
+        if(decrypt and padding and size == len(chunk)):
+            size -= n
+
+        if(size > 0):
+            out = bytearray(size)
+            process(memoryview(chunk)[:size], out, 0)
+            yield out
+        carry = chunk[max(size, 0):]
+
+    # Final block(s)
+    if(padding and not decrypt):
+        carry = pad(carry, n)
+    elif(mode != "CTR" and len(carry) % n):
+        raise ValueError("Input is not a multiple of the block size")
+
+    out = bytearray(len(carry))
+    process(carry, out, 0)
+    if(padding and decrypt):
+        out = unpad(out, n)
+    if(out):
+        yield out
+
+
+# Description: Encrypts source with cipher in the given mode and
+#              returns a generator of ciphertext chunks.
+# Note:        For CTR, iv is the initial counter block and padding
+#              is never applied.
+def encrypt(cipher, source, mode = "CBC", iv = None, padding = True,
+            chunkSize = CHUNK_SIZE):
+    return stream(cipher, source, mode, iv, padding, False, chunkSize)
+
+
+# Description: Decrypts source with cipher in the given mode and
+#              returns a generator of plaintext chunks.
+def decrypt(cipher, source, mode = "CBC", iv = None, padding = True,
+            chunkSize = CHUNK_SIZE):
+    return stream(cipher, source, mode, iv, padding, True, chunkSize)
+
+
+# Description: Writes the chunks of a generator into the caller's
+#              buffer out. Returns the number of bytes written.
+def writeInto(generator, out):
+    view = memoryview(out).cast("B")
+    offset = 0
+
+    for chunk in generator:
+        if(offset + len(chunk) > len(view)):
+            raise ValueError("Output buffer is too small")
+        view[offset:offset + len(chunk)] = chunk
+        offset += len(chunk)
+
+    return offset
+
+
+# Description: Same as encrypt, but writes the ciphertext into the
+#              preallocated buffer out and returns the number of bytes
+#              written. With padding, out needs room for one extra
+#              block.
+def encryptInto(cipher, source, out, mode = "CBC", iv = None,
+                padding = True, chunkSize = CHUNK_SIZE):
+    return writeInto(encrypt(cipher, source, mode, iv, padding, chunkSize), out)
+
+
+# Description: Same as decrypt, but writes the plaintext into the
+#              preallocated buffer out and returns the number of bytes
+#              written.
+def decryptInto(cipher, source, out, mode = "CBC", iv = None,
+                padding = True, chunkSize = CHUNK_SIZE):
+    return writeInto(decrypt(cipher, source, mode, iv, padding, chunkSize), out)
+
+
+##### PARALLEL MODES #####
+
+# Default size of the segments handed to each worker
+SEGMENT_SIZE = 1 << 20
+
+# Cipher of the current worker process (set by setWorkerCipher)
+workerCipher = None
+
+
+# Description: Pool initializer. Each worker receives the cipher
+#              object, and with it the already expanded key schedule,
+#              once instead of with every segment.
+def setWorkerCipher(cipher):
+    global workerCipher
+    workerCipher = cipher
+
+
+# Description: Runs one segment in a worker process. For CTR, counter
+#              is the counter block of the first block in the segment.
+def segmentWorker(mode, data, counter, decrypt):
+    out = bytearray(len(data))
+    blockFunction(workerCipher, mode, counter, decrypt)(data, out, 0)
+    return out
+
+
+# Description: Regroups the chunks of source into segments of size
+#              bytes. Yields (segment, isLast) pairs.
+def segments(source, size):
+    buffer = bytearray()
+    previous = None
+
+    for chunk in chunks(source, size):
+        buffer += chunk
+        while(len(buffer) >= size):
+            if(previous is not None):
+                yield previous, False
+            previous = bytes(buffer[:size])
+            del buffer[:size]
+
+    # Flush whatever is left, marking the final segment
+    if(buffer):
+        if(previous is not None):
+            yield previous, False
+        yield bytes(buffer), True
+    elif(previous is not None):
+        yield previous, True
+
+
+# Description: Generator behind parallelEncrypt and parallelDecrypt.
+#              Keeps at most two segments per worker in flight and
+#              yields the results in input order.
+def parallelStream(cipher, source, mode, iv, padding, decrypt,
+                   workers, segmentSize):
+    n = cipher.blockSize
+    if(mode not in ("ECB", "CTR")):
+        raise ValueError("Only ECB and CTR can run in parallel")
+    if(segmentSize % n):
+        raise ValueError("segmentSize must be a multiple of the block size")
+
+    if(mode == "CTR" and iv is None):
+        raise ValueError("CTR mode needs an IV")
+
+    padding = padding and mode == "ECB"
+    counter = toBlock(iv, n) if mode == "CTR" else None
+    mask = (1 << 8*n) - 1
+    workers = workers or os.cpu_count()
+    pending = []
+    received = False
+
+    # Result of a segment, with the padding stripped from the last one
+    def finish(future, isLast):
+        out = future.result()
+        if(isLast and padding and decrypt):
+            out = unpad(out, n)
+        return out
+
+    with ProcessPoolExecutor(workers, initializer = setWorkerCipher,
+                             initargs = (cipher,)) as pool:
+        for data, last in segments(source, segmentSize):
+            if(last and padding and not decrypt):
+                data = pad(data, n)
+            elif(last and mode == "ECB" and len(data) % n):
+                raise ValueError("Input is not a multiple of the block size")
+
+            pending.append((pool.submit(segmentWorker, mode, data, counter, decrypt), last))
+            received = True
+            if(mode == "CTR"):
+                counter = (counter + len(data) // n) & mask
+
+            # Wait for the oldest segment once the window is full
+            if(len(pending) >= 2*workers):
+                yield finish(*pending.pop(0))
+
+        # Empty input still produces a padding block, and is never
+        # valid padded ciphertext (as in stream)
+        if(not received and padding):
+            if(decrypt):
+                raise ValueError("Invalid PKCS#7 padding")
+            pending.append((pool.submit(segmentWorker, mode, pad(b"", n), counter, False), True))
+
+        for future, isLast in pending:
+            yield finish(future, isLast)
+
+
+# Description: Encrypts source in ECB or CTR mode on a pool of worker
+#              processes and returns a generator of ciphertext
+#              segments in order. workers defaults to the number of
+#              CPUs; segmentSize must be a multiple of the block size.
+def parallelEncrypt(cipher, source, mode = "CTR", iv = None, padding = True,
+                    workers = None, segmentSize = SEGMENT_SIZE):
+    return parallelStream(cipher, source, mode, iv, padding, False,
+                          workers, segmentSize)
+
+
+# Description: Decrypts source in ECB or CTR mode on a pool of worker
+#              processes and returns a generator of plaintext segments.
+def parallelDecrypt(cipher, source, mode = "CTR", iv = None, padding = True,
+                    workers = None, segmentSize = SEGMENT_SIZE):
+    return parallelStream(cipher, source, mode, iv, padding, True,
+                          workers, segmentSize)
+
+
+# Description: Measures CTR throughput for each worker count on size
+#              bytes of input. Returns a dict of workers -> MB/s.
+# Note:        The default worker counts stop at the number of CPUs;
+#              counts given in workerCounts are all measured.
+def benchmarkParallel(cipher, size = 1 << 22, workerCounts = None,
+                      segmentSize = SEGMENT_SIZE // 4):
+    data = os.urandom(size)
+    counts = workerCounts or sorted(w for w in {1, 2, 4, 8, 16, 32, os.cpu_count()}
+                                    if w <= os.cpu_count())
+    results = {}
+
+    for workers in counts:
+        start = time.perf_counter()
+        for segment in parallelEncrypt(cipher, data, "CTR", 0, False,
+                                       workers, segmentSize):
+            pass
+        results[workers] = size / (time.perf_counter() - start) / 1e6
+
+    return results
+
+
+if __name__ == "__main__":
+    import aes
+    print("\nParallel AES-CTR throughput (MB/s)")
+    print("----------------------------------")
+    for workers, rate in benchmarkParallel(aes.AES(aes.KAT[0])).items():
+        print(workers, "workers:", rate)
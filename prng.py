@@ -1,22 +1,66 @@
-# To get byte size of key in RC4
-import sys
+# Used for RC4 throughput measurements
+import time
+
+# NumPy is only needed for LCGStreams
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # Description: Generates a sequence of pseudo-random numbers
 #              using a Linear Congruential Generator. Follows
 #              the relation X_{n+1} = (a * X_n) mod m.
 # Note:        For convenience and choice limitations, a and m
 #              are default initialized to 7^5 and 2^{31} - 1.
+# Note:        Yields X_1, ..., X_{num_random} for X_0 = seed.
 def LCG(seed, num_random, a = 7**5, m = 2**31 - 1):
     for i in range(num_random):
         seed = (a * seed) % m
-        print(seed)
+        yield seed
+
+
+# Description: Jumps the LCG ahead k steps in O(log k) using
+#              X_{n+k} = (a^k mod m) * X_n mod m. Worker i of a
+#              split sequence can start at LCGSkip(seed, i*k).
+def LCGSkip(seed, k, a = 7**5, m = 2**31 - 1):
+    return pow(a, k, m) * seed % m
+
+
+# Description: Generates streams x length LCG values at once with
+#              NumPy. Row i is the serial sequence from offset
+#              i*length, so the flattened array equals
+#              list(LCG(seed, streams*length, a, m)).
+# Note:        Needs (m - 1)^2 < 2^63 for the int64 products (true for
+#              the default m); otherwise a*(m - 1) < 2^63 with a slower
+#              column-by-column loop.
+def LCGStreams(seed, streams, length, a = 7**5, m = 2**31 - 1):
+    if(np is None):
+        raise ImportError("LCGStreams requires NumPy")
+
+    # Start of every stream (offsets i*length) and powers a^1..a^length
+    starts = np.array([LCGSkip(seed, i*length, a, m) for i in range(streams)], np.int64)
+    if((m - 1)**2 < 2**63):
+        powers = np.array(list(LCG(1, length, a, m)), np.int64)
+        return np.outer(starts, powers) % m
+
+    if(a*(m - 1) >= 2**63):
+        raise ValueError("a and m are too large for 64-bit streams")
+    out = np.empty((streams, length), np.int64)
+    x = starts
+    for t in range(length):
+        x = x * a % m
+        out[:, t] = x
+    return out
 
 
 # Description: An implementation of the Blum Blum Shub PRNG.
 #              p and q MUST be  large primes that are 3 mod 4
 #              and the seed must be relatively prime to these.
 #              (Think about Legendre Symbol/quadratic residues)
-def BBS(seed, num_random, p, q):
+# Note:        Yields the low bits bits of each square (one bit
+#              by default). This is the serial reference for
+#              BBSStream.
+def BBS(seed, num_random, p, q, bits = 1):
     # Calculate modulus and seed
     n = p * q
     seed = (seed**2) % n
@@ -24,37 +68,191 @@ def BBS(seed, num_random, p, q):
     # Generate bits
     for i in range(num_random):
         seed = (seed**2) % n
-        print(seed & 1)
+        yield seed & ((1 << bits) - 1)
+
+
+# Description: Packs values of bits bits each (most significant
+#              first) into bytes. Trailing bits that do not fill a
+#              whole byte are dropped.
+def packBits(values, bits):
+    total = 0
+    count = 0
+    for value in values:
+        total = (total << bits) | value
+        count += bits
+    total >>= count % 8
+    return total.to_bytes(count // 8, "big")
 
 
-# Description: An implementation of the RC4 PRNG.
+# Description: A Blum Blum Shub generator producing packed bytes.
+#              Each square yields floor(log2(log2 n)) low bits (or
+#              bits, if given) and is computed mod p and mod q
+#              separately, then recombined with the CRT.
+# Note:        x_i = x_0^(2^i) mod n is found directly from the
+#              exponents 2^i mod (p - 1) and 2^i mod (q - 1) (the
+#              CRT form of 2^i mod lcm(p - 1, q - 1)), so start (or
+#              seek) can jump to any step, e.g. to split the output
+#              across processes.
+# Note:        read(k) returns the same bytes as packBits over BBS
+#              with the same bits, starting at step start + 1.
+class BBSStream:
+    def __init__(self, seed, p, q, bits = None, start = 0):
+        self.p, self.q = p, q
+        self.n = n = p * q
+        self.bits = bits or max(1, (n.bit_length() - 1).bit_length() - 1)
+        self.qInv = pow(q, -1, p)
+        self.x0 = seed * seed % n
+        self.seek(start)
+
+    # Description: Moves to step i, so the next square is x_{i+1}.
+    def seek(self, i):
+        p, q = self.p, self.q
+        self.step = i
+        self.xp = pow(self.x0 % p, pow(2, i, p - 1), p)
+        self.xq = pow(self.x0 % q, pow(2, i, q - 1), q)
+        self.carry = 0
+        self.carryBits = 0
+
+    # Description: Returns x_i mod n for any i (random access).
+    def state(self, i):
+        p, q = self.p, self.q
+        xp = pow(self.x0 % p, pow(2, i, p - 1), p)
+        xq = pow(self.x0 % q, pow(2, i, q - 1), q)
+        return xq + q * ((xp - xq) * self.qInv % p)
+
+    # Description: Returns the next count bytes of output.
+    def read(self, count):
+        p, q, qInv = self.p, self.q, self.qInv
+        bits = self.bits
+        mask = (1 << bits) - 1
+        xp, xq = self.xp, self.xq
+        total, totalBits = self.carry, self.carryBits
+        steps = max(0, -(-(8*count - totalBits) // bits))
+
+        values = []
+        for i in range(steps):
+            xp = xp * xp % p
+            xq = xq * xq % q
+            values.append((xq + q * ((xp - xq) * qInv % p)) & mask)
+
+        # Pack the new values behind any bits left from the last read
+        for value in values:
+            total = (total << bits) | value
+        totalBits += steps * bits
+        self.carryBits = totalBits - 8*count
+        self.carry = total & ((1 << self.carryBits) - 1)
+        self.xp, self.xq = xp, xq
+        self.step += steps
+        return (total >> self.carryBits).to_bytes(count, "big")
+
+
+# Description: An implementation of the RC4 PRNG. Yields
+#              num_random keystream bytes for key (bytes, or an
+#              int taken as big-endian bytes).
 def RC4(key, num_random):
-    # Initialize vectors
-    S = [i for i in range(255)]
-    T = [(key >> i % sys.getsizeof(key)) & 1 for i in range(255)]
-
-    # Permute S with pseudorandom swaps
-    j = 0
-    for i in range(255):
-        # Next permutation
-        j = (j + S[i] + T[i]) % 256
-
-        # Swap
-        temp = S[i]
-        S[i] = S[j]
-        S[j] = temp
-
-    # Generate numbers
-    j = k = 0
-    for i in range(num_random):
-        # Next pair to swap
-        j = (j + 1) % 256
-        k = (k + S[j]) % 256
-        
-        # Swap
-        temp = S[j]
-        S[j] = S[k]
-        S[k] = temp
-
-        # Next number
-        print(S[(S[j] + S[k]) % 256])
+    yield from RC4Stream(key).keystream(num_random)
+
+
+# Default number of bytes handled at a time by RC4Stream
+CHUNK_SIZE = 1 << 16
+
+
+# Description: An RC4 keystream generator with state kept between
+#              calls, so output can be produced in chunks. drop
+#              discards that many initial keystream bytes (RC4-drop).
+class RC4Stream:
+    def __init__(self, key, drop = 0):
+        if(isinstance(key, int)):
+            key = key.to_bytes((key.bit_length() + 7) // 8 or 1, "big")
+        if(not 1 <= len(key) <= 256):
+            raise ValueError("RC4 keys are 1 to 256 bytes")
+
+        # Key scheduling: permute S with pseudorandom swaps
+        S = list(range(256))
+        j = 0
+        for i in range(256):
+            j = (j + S[i] + key[i % len(key)]) % 256
+            S[i], S[j] = S[j], S[i]
+        self.S = S
+        self.i = self.j = 0
+
+        # Discard the first drop bytes
+        while(drop > 0):
+            n = min(drop, CHUNK_SIZE)
+            self.fill(bytearray(n))
+            drop -= n
+
+    # Description: Overwrites buffer (a bytearray or writable
+    #              memoryview) with the next len(buffer) keystream
+    #              bytes.
+    def fill(self, buffer):
+        S = self.S
+        i, j = self.i, self.j
+        for n in range(len(buffer)):
+            i = (i + 1) & 0xff
+            a = S[i]
+            j = (j + a) & 0xff
+            b = S[j]
+            S[i] = b
+            S[j] = a
+            buffer[n] = S[(a + b) & 0xff]
+        self.i, self.j = i, j
+        return buffer
+
+    # Description: Returns the next n keystream bytes.
+    def keystream(self, n):
+        return bytes(self.fill(bytearray(n)))
+
+    # Description: XORs the keystream into buffer in place.
+    def xorInto(self, buffer):
+        view = memoryview(buffer).cast("B")
+        stream = self.fill(bytearray(len(view)))
+        result = int.from_bytes(view, "big") ^ int.from_bytes(stream, "big")
+        view[:] = result.to_bytes(len(view), "big")
+        return buffer
+
+    # Description: Returns data XORed with the keystream.
+    def xor(self, data):
+        return bytes(self.xorInto(bytearray(data)))
+
+    # Description: Encrypts (or decrypts) the file object source into
+    #              the file object target, chunkSize bytes at a time.
+    #              Returns the number of bytes written.
+    def xorFile(self, source, target, chunkSize = CHUNK_SIZE):
+        buffer = bytearray(chunkSize)
+        total = 0
+        while(True):
+            n = source.readinto(buffer)
+            if(not n):
+                return total
+            chunk = memoryview(buffer)[:n]
+            self.xorInto(chunk)
+            target.write(chunk)
+            total += n
+
+
+# Description: Measures keystream throughput of RC4Stream against
+#              AES in CTR mode on size bytes. Returns a dict of
+#              engine -> MB/s.
+def benchmark(size = 1 << 20):
+    import aes, modes
+    data = bytes(size)
+    results = {}
+
+    start = time.perf_counter()
+    RC4Stream(b"benchmark key").xorInto(bytearray(data))
+    results["RC4"] = size / (time.perf_counter() - start) / 1e6
+
+    start = time.perf_counter()
+    for chunk in modes.encrypt(aes.AES(aes.KAT[0]), data, "CTR", 0):
+        pass
+    results["AES-CTR"] = size / (time.perf_counter() - start) / 1e6
+
+    return results
+
+
+if __name__ == "__main__":
+    print("\nKeystream throughput (MB/s)")
+    print("---------------------------")
+    for name, rate in benchmark().items():
+        print(name, rate)
@@ -0,0 +1,209 @@
+# Description: Statistical test battery and throughput measurement
+#              for the generators in prng.py (and os.urandom as a
+#              control). Output is consumed in chunks, so the amount
+#              of data tested does not change the memory used.
+# Note:        The tests follow the Handbook of Applied Cryptography
+#              (5.4.4) and NIST SP 800-22: monobit, runs, poker (4-bit),
+#              serial (2-bit), autocorrelation and a chi-square test
+#              on the byte distribution. A test passes when its
+#              p-value is at least ALPHA.
+
+# PRNGs under test (and primes for BBS)
+import prng
+import rsaKey
+
+# Used for the test math, timing and output
+import numpy as np
+import math
+import json
+import os
+import time
+
+# Significance level of every test
+ALPHA = 0.01
+
+# Default bytes per chunk and bit shift of the autocorrelation test
+CHUNK_SIZE = 1 << 20
+SHIFT = 16
+
+
+# Description: Regularized upper incomplete gamma function Q(a, x),
+#              by series for x < a + 1 and continued fraction
+#              otherwise (Numerical Recipes 6.2).
+def gammaQ(a, x):
+    if(x <= 0):
+        return 1.0
+    lead = math.exp(-x + a*math.log(x) - math.lgamma(a))
+
+    if(x < a + 1):
+        term = total = 1.0 / a
+        n = a
+        while(abs(term) > abs(total) * 1e-15):
+            n += 1
+            term *= x / n
+            total += term
+        return 1.0 - total * lead
+
+    b = x + 1 - a
+    c = 1e300
+    d = 1.0 / b
+    h = d
+    for i in range(1, 10000):
+        an = -i * (i - a)
+        b += 2
+        d = an*d + b
+        d = 1e-300 if abs(d) < 1e-300 else d
+        c = b + an/c
+        c = 1e-300 if abs(c) < 1e-300 else c
+        d = 1.0 / d
+        h *= d*c
+        if(abs(d*c - 1) < 1e-15):
+            break
+    return lead * h
+
+
+# Description: p-value of a chi-square statistic with df degrees of
+#              freedom, and of a standard normal statistic (two-sided).
+def chiSquareP(x, df):
+    return gammaQ(df / 2, x / 2)
+
+def normalP(z):
+    return math.erfc(abs(z) / math.sqrt(2))
+
+
+# Description: Accumulates the counts needed by every test over a
+#              stream of chunks. update takes bytes-like chunks and
+#              results returns the statistic, p-value and verdict of
+#              each test.
+class Battery:
+    def __init__(self, shift = SHIFT):
+        self.shift = shift
+        self.bits = 0
+        self.ones = 0
+        self.transitions = 0
+        self.pairs = np.zeros(4, np.int64)
+        self.differences = 0
+        self.nibbles = np.zeros(16, np.int64)
+        self.bytes = np.zeros(256, np.int64)
+        self.tail = np.zeros(0, np.uint8)
+
+    # Description: Adds one chunk of generator output.
+    def update(self, chunk):
+        data = np.frombuffer(chunk, np.uint8)
+        bits = np.unpackbits(data)
+        self.bytes += np.bincount(data, minlength = 256)
+        self.nibbles += np.bincount(np.concatenate((data >> 4, data & 0xf)), minlength = 16)
+        self.ones += int(bits.sum())
+        self.bits += bits.size
+
+        # Tests over neighbouring bits also cover the chunk boundary,
+        # using the last bits of the previous chunk
+        joined = np.concatenate((self.tail[-1:], bits))
+        if(joined.size > 1):
+            self.transitions += int(np.count_nonzero(joined[1:] != joined[:-1]))
+            self.pairs += np.bincount(2*joined[:-1] + joined[1:], minlength = 4)
+        joined = np.concatenate((self.tail, bits))
+        if(joined.size > self.shift):
+            self.differences += int(np.count_nonzero(joined[self.shift:] ^ joined[:-self.shift]))
+        self.tail = joined[-self.shift:].copy()
+
+    # Description: Returns a dict of test -> {statistic, pValue, pass}.
+    def results(self):
+        n = self.bits
+        tests = {}
+
+        # Monobit: normalized excess of ones
+        z = (2*self.ones - n) / math.sqrt(n)
+        tests["monobit"] = (z, normalP(z))
+
+        # Runs (NIST 2.3): number of runs given the proportion of ones
+        pi = self.ones / n
+        runs = self.transitions + 1
+        z = (runs - 2*n*pi*(1 - pi)) / (2*math.sqrt(n)*pi*(1 - pi)) if 0 < pi < 1 else math.inf
+        tests["runs"] = (z, normalP(z) if abs(pi - 0.5) < 2 / math.sqrt(n) else 0.0)
+
+        # Poker: 4-bit blocks, 15 degrees of freedom
+        k = int(self.nibbles.sum())
+        x = 16 / k * float((self.nibbles.astype(float)**2).sum()) - k
+        tests["poker"] = (x, chiSquareP(x, 15))
+
+        # Serial: overlapping 2-bit patterns, 2 degrees of freedom
+        n1 = np.array([n - self.ones, self.ones], float)
+        x = (4 / (n - 1) * float((self.pairs.astype(float)**2).sum())
+             - 2 / n * float((n1**2).sum()) + 1)
+        tests["serial"] = (x, chiSquareP(x, 2))
+
+        # Autocorrelation at a shift of self.shift bits
+        m = n - self.shift
+        z = 2*(self.differences - m / 2) / math.sqrt(m)
+        tests["autocorrelation"] = (z, normalP(z))
+
+        # Chi-square on the byte distribution, 255 degrees of freedom
+        expected = n / 8 / 256
+        x = float(((self.bytes - expected)**2).sum()) / expected
+        tests["byteChiSquare"] = (x, chiSquareP(x, 255))
+
+        return {name: {"statistic": s, "pValue": p, "pass": p >= ALPHA}
+                for name, (s, p) in tests.items()}
+
+
+# Description: Returns a prime of the given size that is 3 mod 4.
+def blumPrime(bits):
+    while(True):
+        p = rsaKey.genPrime(bits)
+        if(p % 4 == 3):
+            return p
+
+
+# Description: Returns a dict of generator name -> read function
+#              returning the next n bytes of that generator.
+def sources(seed = 1, bbsBits = 512):
+    def lcg(n):
+        values = prng.LCGStreams(lcg.seed, 1, n)[0]
+        lcg.seed = int(values[-1]) if n else lcg.seed
+        return (values >> 23).astype(np.uint8).tobytes()
+    lcg.seed = seed
+
+    bbs = prng.BBSStream(seed + 2, blumPrime(bbsBits), blumPrime(bbsBits))
+    rc4 = prng.RC4Stream(seed.to_bytes(16, "big"), drop = 3072)
+    return {"LCG": lcg, "BBS": bbs.read, "RC4": rc4.keystream, "urandom": os.urandom}
+
+
+# Description: Runs the battery over size bytes of read, chunkSize
+#              bytes at a time. Returns a dict with the byte count,
+#              generator throughput (bytes/sec, generation time only)
+#              and the results of every test.
+def evaluate(read, size, chunkSize = CHUNK_SIZE):
+    battery = Battery()
+    generating = 0.0
+    done = 0
+
+    while(done < size):
+        n = min(chunkSize, size - done)
+        start = time.perf_counter()
+        chunk = read(n)
+        generating += time.perf_counter() - start
+        battery.update(chunk)
+        done += n
+
+    tests = battery.results()
+    return {"bytes": size, "bytesPerSecond": size / generating if generating else None,
+            "pass": all(test["pass"] for test in tests.values()), "tests": tests}
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description = "PRNG test battery")
+    parser.add_argument("--bytes", type = int, default = 1 << 20,
+                        help = "bytes per generator (BBS and RC4 are slow)")
+    parser.add_argument("--chunk-size", type = int, default = CHUNK_SIZE)
+    parser.add_argument("--seed", type = int, default = 1)
+    parser.add_argument("generators", nargs = "*", help = "default: all")
+    args = parser.parse_args()
+
+    # One JSON object per line and generator
+    for name, read in sources(args.seed).items():
+        if(args.generators and name not in args.generators):
+            continue
+        result = evaluate(read, args.bytes, args.chunk_size)
+        print(json.dumps(dict(generator = name, **result)))
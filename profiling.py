@@ -0,0 +1,138 @@
+# Description: Opt-in per-stage profiling of the AES and DES round
+#              functions. enable() swaps each stage function in its
+#              module (and in the module's BACKENDS table) for a timing
+#              wrapper and disable() puts the originals back, so while
+#              profiling is off the hot paths are exactly the original
+#              functions and pay nothing.
+# Note:        Stages call each other through module globals, so
+#              nested stages (e.g. MixColumns inside referenceBlock)
+#              are timed too. stats() gives calls and cumulative
+#              nanoseconds per stage; folded() gives self time per
+#              call stack in the folded format read by flamegraph.pl
+#              and speedscope.
+
+import aes
+import des
+
+# Used for the timers
+from collections import defaultdict
+import time
+
+# Stage functions that can be profiled, per module
+STAGES = {aes: ("SubBytes", "ShiftRows", "MixColumns", "AddRoundKey",
+                "keyExpansion", "referenceBlock", "tableBlock",
+                "tableBlockInto"),
+          des: ("permute", "substitute", "desRound", "keySchedule",
+                "referenceBlock", "tablePermute", "bufferPermute",
+                "tableKeySchedule", "tableBlock", "tableBlockInto",
+                "tripleBlock", "tripleBlockInto")}
+
+# Original functions while enabled, as (module, name) -> function
+originals = {}
+
+# Collected data: calls and nanoseconds per stage, self nanoseconds
+# per call stack, and the stacks of active stages and child time
+calls = defaultdict(int)
+totals = defaultdict(int)
+stacks = defaultdict(int)
+active = []
+children = []
+
+
+# Description: Returns a wrapper of fn that records its calls and
+#              time under name.
+def wrap(name, fn):
+    clock = time.perf_counter_ns
+
+    def wrapper(*args, **kwargs):
+        active.append(name)
+        children.append(0)
+        start = clock()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = clock() - start
+            stacks[";".join(active)] += elapsed - children.pop()
+            active.pop()
+            calls[name] += 1
+            totals[name] += elapsed
+            if(children):
+                children[-1] += elapsed
+
+    wrapper.__wrapped__ = fn
+    return wrapper
+
+
+# Description: Replaces the stage functions of the given modules
+#              (default: all of STAGES) with timing wrappers.
+def enable(modules = None):
+    for module in modules or STAGES:
+        swaps = {}
+        for stage in STAGES[module]:
+            if((module, stage) in originals):
+                continue
+            fn = getattr(module, stage)
+            originals[(module, stage)] = fn
+            swaps[fn] = wrap(module.__name__ + "." + stage, fn)
+            setattr(module, stage, swaps[fn])
+        swapBackends(module, swaps)
+
+
+# Description: Puts the original functions back.
+def disable():
+    restores = defaultdict(dict)
+    for (module, stage), fn in originals.items():
+        restores[module][getattr(module, stage)] = fn
+        setattr(module, stage, fn)
+    for module, swaps in restores.items():
+        swapBackends(module, swaps)
+    originals.clear()
+
+
+# Description: Replaces functions in the BACKENDS table of module
+#              according to swaps (old function -> new function).
+def swapBackends(module, swaps):
+    for name, entry in module.BACKENDS.items():
+        module.BACKENDS[name] = tuple(swaps.get(fn, fn) for fn in entry)
+
+
+# Description: Clears the collected data.
+def reset():
+    for table in (calls, totals, stacks):
+        table.clear()
+
+
+# Description: Returns a dict of stage -> {calls, ns} (ns includes
+#              nested stages).
+def stats():
+    return {name: {"calls": calls[name], "ns": totals[name]} for name in calls}
+
+
+# Description: Returns the self time per call stack in the folded
+#              format, one "stage;stage;stage nanoseconds" per line.
+def folded():
+    return "".join("%s %d\n" % (stack, ns) for stack, ns in sorted(stacks.items()))
+
+
+# Description: Writes folded() to path.
+def writeFolded(path):
+    with open(path, "w") as f:
+        f.write(folded())
+
+
+if __name__ == "__main__":
+    enable()
+    for i in range(20):
+        aes.aes(i, aes.KAT[0], False, "reference")
+        aes.aes(i, aes.KAT[0], True)
+        des.encrypt(i, des.KAT[0], backend = "reference")
+        des.encrypt(i, des.KAT[0])
+    disable()
+
+    print("\nStage calls and milliseconds")
+    print("----------------------------")
+    for name, data in sorted(stats().items(), key = lambda item: -item[1]["ns"]):
+        print(name, data["calls"], data["ns"] / 1e6)
+    print("\nFolded stacks")
+    print("-------------")
+    print(folded())
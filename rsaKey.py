@@ -1,13 +1,21 @@
 # Used for PRNG purposes.
 import random
 
+# Used by the batch key generator and the benchmarks
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import os
+import time
+
 
 # Description: An implementation of the Miller-Rabin
 #              primality test up to 99.9% accuracy.
-# Note:        Assumed that n is sufficiently
-#              large (for randint function).
-def MillerRabin(n):
-    # Check parity
+# Note:        Uses modular exponentiation (pow with a modulus)
+#              so the cost grows with the bit length of n rather
+#              than with n itself.
+def MillerRabin(n, rounds = 10):
+    # Small and even numbers
+    if(n < 4):
+        return n in (2, 3)
     if(not n % 2):
         return False
 
@@ -18,57 +26,146 @@ def MillerRabin(n):
         k += 1
         q //= 2
 
-    # Conduct 10 tests for 99.9% accuracy (1 - 1/(2^10))
-    for i in range(10):
+    # Conduct rounds tests; a composite passes each with probability
+    # at most 1/4, so the error is at most 4^-rounds
+    for i in range(rounds):
         a = random.randint(2, n - 2)
 
         # Check gcd
         if(gcd(a, n) != 1):
             return False
 
-        # Check primality conditions
-        if(a**q % n != 1) and (n-1 not in [a**((2**j)*q) % n for j in range(k)]):
+        # Check primality conditions: a^q = 1 or a^((2^j)q) = -1
+        x = pow(a, q, n)
+        if(x == 1 or x == n - 1):
+            continue
+        for j in range(k - 1):
+            x = x * x % n
+            if(x == n - 1):
+                break
+        else:
             return False
 
     # All tests passed
     return True
 
 
+# Description: Returns all primes below limit (sieve of Eratosthenes).
+def smallPrimes(limit):
+    sieve = bytearray([1]) * limit
+    sieve[0:2] = b"\x00\x00"
+    for i in range(2, int(limit**0.5) + 1):
+        if(sieve[i]):
+            sieve[i*i::i] = bytes(len(range(i*i, limit, i)))
+    return [i for i in range(limit) if sieve[i]]
+
+
+# Odd primes used for trial division before Miller-Rabin
+SMALL_PRIMES = smallPrimes(2048)[1:]
+
+# Number of odd candidates sieved at a time by genPrime
+WINDOW = 4096
+
+
+# Description: Marks the candidates start, start + 2, ... (window of
+#              them) that have a factor in SMALL_PRIMES. Returns a
+#              bytearray with 1 for every candidate that survives.
+def sieveWindow(start, window = WINDOW):
+    survivors = bytearray([1]) * window
+    for p in SMALL_PRIMES:
+        if(p >= start):
+            break
+        # First index i with start + 2i = 0 mod p
+        i = (-start * pow(2, -1, p)) % p
+        survivors[i::p] = bytes(len(range(i, window, p)))
+    return survivors
+
+
+# Description: Generates a random prime of exactly bits bits (the top
+#              two bits are set, so the product of two such primes
+#              has 2*bits bits). Random odd windows are sieved by
+#              SMALL_PRIMES and only survivors reach Miller-Rabin.
+# Note:        stats, if given, is a dict whose "tested" and
+#              "rejected" counts of Miller-Rabin candidates and
+#              failures are increased.
+def genPrime(bits, stats = None):
+    if(not 2 <= bits <= 4096):
+        raise ValueError("bits must be between 2 and 4096")
+    if(bits < 12):
+        while(True):
+            n = random.randint(2**(bits - 1), 2**bits - 1)
+            if(MillerRabin(n)):
+                return n
+
+    while(True):
+        start = random.getrandbits(bits) | (3 << (bits - 2)) | 1
+        window = min(WINDOW, (2**bits - start) // 2)
+        survivors = sieveWindow(start, window)
+
+        for i in range(window):
+            if(not survivors[i]):
+                continue
+            if(stats is not None):
+                stats["tested"] = stats.get("tested", 0) + 1
+            if(MillerRabin(start + 2*i)):
+                return start + 2*i
+            if(stats is not None):
+                stats["rejected"] = stats.get("rejected", 0) + 1
+
+
+# Description: Times count primes of each size. Returns a dict of
+#              bits -> average seconds per prime.
+def benchmarkPrimes(sizes = (1024, 2048), count = 5):
+    results = {}
+    for bits in sizes:
+        start = time.perf_counter()
+        for i in range(count):
+            genPrime(bits)
+        results[bits] = (time.perf_counter() - start) / count
+    return results
+
+
 # Description: An implementation of the Euclidean
 #              algorithm to find the gcd of a and b.
+# Note:        Iterative, since the recursive form runs out
+#              of stack on numbers of a few thousand bits.
 def gcd(a, b):
-    return a if b == 0 else gcd(b, a % b)
+    while(b):
+        a, b = b, a % b
+    return a
 
 
 # Decription: Finds the inverse of a mod m using
 #             the Extended Euclidean Algorithm.
-def modInvHelper(m, a, r1, r2):
-    return (a, m % a, r2, -(m // a) * r2 + r1)
 def modInverse(m, a):
-    newM = m 
-    newA = a
-    r1 = 0
-    r2 = 1
+    r1, r2 = m, a % m
+    t1, t2 = 0, 1
 
-    while(a*r2 % m != 1):
-        newM, newA, r1, r2 = modInvHelper(newM, newA, r1, r2)
+    # Iterate until the remainder reaches zero
+    while(r2):
+        quotient = r1 // r2
+        r1, r2 = r2, r1 - quotient * r2
+        t1, t2 = t2, t1 - quotient * t2
 
-    return r2 % m
+    if(r1 != 1):
+        raise ValueError("%d has no inverse mod %d" % (a, m))
+    return t1 % m
 
 
-# Description: Generates an RSA public/private key pair.
+# Description: Generates an RSA public/private key pair and
+#              returns it as an RSAKey (printing it if verbose).
 # Note:        For simplicity, the sizes of p and q are
-#              quite limited. This is, of course, by no
-#              means secure and is only for conceptual
-#              understanding purposes.
-def genKey():
-    p = q = e = 0
+#              quite limited by default (bits). This is, of
+#              course, by no means secure and is only for
+#              conceptual understanding purposes.
+def genKey(bits = 16, verbose = False):
+    e = 0
 
     # Find p and q
-    while(not MillerRabin(p)):
-        p = random.randint(1, 65536)
-    while(not MillerRabin(q)):
-        q = random.randint(1, 65536)
+    p = genPrime(bits)
+    q = genPrime(bits)
+    while(q == p):
+        q = genPrime(bits)
 
     n = p * q
     phin = (p-1) * (q-1)
@@ -78,6 +175,197 @@ def genKey():
         e = random.randint(1, 65536)
     d = modInverse(phin, e)
 
-    print(p, q)
-    print("Private key: ", d)
-    print("Public key: (", e, ", ", n, ")")
+    if(verbose):
+        print(p, q)
+        print("Private key: ", d)
+        print("Public key: (", e, ", ", n, ")")
+    return RSAKey(n, e, d, p, q)
+
+
+# Description: Finds one prime in a worker process. Returns the
+#              prime and the Miller-Rabin counters of the search.
+def primeWorker(bits):
+    stats = {"tested": 0, "rejected": 0}
+    return genPrime(bits, stats), stats
+
+
+# Description: Generates count RSA keys with a modulus of 2*bits bits
+#              on a pool of worker processes searching for primes.
+#              Primes are paired into keys as they arrive and each key
+#              is yielded as soon as it is ready.
+# Note:        metrics, if given, is a dict updated in place with the
+#              primes found, Miller-Rabin candidates tested and
+#              rejected, keys made, elapsed seconds and keys/second.
+def genKeys(count, bits = 1024, workers = None, e = 65537, metrics = None):
+    metrics = {} if metrics is None else metrics
+    metrics.update(primes = 0, tested = 0, rejected = 0, keys = 0,
+                   seconds = 0.0, keysPerSecond = 0.0)
+    began = time.perf_counter()
+    spare = None
+    pending = set()
+
+    workers = workers or os.cpu_count()
+
+    with ProcessPoolExecutor(workers) as pool:
+        while(metrics["keys"] < count):
+            # Keep one prime search running per worker, but no more
+            # than the primes still needed
+            needed = 2*(count - metrics["keys"]) - (spare is not None)
+            while(len(pending) < min(workers, needed)):
+                pending.add(pool.submit(primeWorker, bits))
+
+            finished, pending = wait(pending, return_when = FIRST_COMPLETED)
+            for future in finished:
+                prime, stats = future.result()
+                metrics["primes"] += 1
+                metrics["tested"] += stats["tested"]
+                metrics["rejected"] += stats["rejected"]
+
+                # Pair with the spare prime if the result is usable
+                if(gcd(e, prime - 1) != 1):
+                    continue
+                if(spare is None or spare == prime):
+                    spare = prime
+                    continue
+                p, q, spare = spare, prime, None
+                key = RSAKey(p * q, e, modInverse((p-1) * (q-1), e), p, q)
+
+                metrics["keys"] += 1
+                metrics["seconds"] = time.perf_counter() - began
+                metrics["keysPerSecond"] = metrics["keys"] / metrics["seconds"]
+                yield key
+                if(metrics["keys"] == count):
+                    break
+
+        for future in pending:
+            future.cancel()
+
+
+# Header of the on-disk key format: magic, then a version byte.
+KEY_MAGIC = b"RSAK"
+KEY_VERSION = 1
+
+
+# Description: An RSA key pair (or public key when the private parts
+#              are None). Private operations use the Chinese Remainder
+#              Theorem with the precomputed dp, dq and qInv, which
+#              works on half-size numbers mod p and mod q.
+class RSAKey:
+    FIELDS = ("n", "e", "d", "p", "q", "dp", "dq", "qInv")
+
+    def __init__(self, n, e, d = None, p = None, q = None):
+        self.n, self.e, self.d, self.p, self.q = n, e, d, p, q
+        self.dp = self.dq = self.qInv = None
+        if(p and q and d):
+            self.dp = d % (p - 1)
+            self.dq = d % (q - 1)
+            self.qInv = modInverse(p, q)
+
+    # Description: Generates a key pair with a modulus of 2*bits bits.
+    @classmethod
+    def generate(cls, bits = 1024, e = 65537):
+        while(True):
+            p, q = genPrime(bits), genPrime(bits)
+            phin = (p-1) * (q-1)
+            if(p != q and gcd(phin, e) == 1):
+                return cls(p * q, e, modInverse(phin, e), p, q)
+
+    # Description: Returns the public half of the key.
+    def publicKey(self):
+        return RSAKey(self.n, self.e)
+
+    # Description: Computes m^e mod n.
+    def encrypt(self, m):
+        return pow(m, self.e, self.n)
+
+    # Description: Computes c^d mod n, via the CRT when p and q are
+    #              known (Garner's recombination).
+    def decrypt(self, c):
+        if(self.qInv is None):
+            if(self.d is None):
+                raise ValueError("Private operation on a public key")
+            return pow(c, self.d, self.n)
+        m1 = pow(c, self.dp, self.p)
+        m2 = pow(c, self.dq, self.q)
+        h = self.qInv * (m1 - m2) % self.p
+        return m2 + h * self.q
+
+    # Description: Signs (private operation) and verifies (public
+    #              operation) an integer message representative.
+    def sign(self, m):
+        return self.decrypt(m)
+
+    def verify(self, m, signature):
+        return self.encrypt(signature) == m
+
+    # Description: Batch versions of encrypt and decrypt over a list
+    #              of messages.
+    def encryptBatch(self, messages):
+        n, e = self.n, self.e
+        return [pow(m, e, n) for m in messages]
+
+    def decryptBatch(self, ciphertexts):
+        return [self.decrypt(c) for c in ciphertexts]
+
+    # Description: Serializes the key as KEY_MAGIC, the version, a
+    #              bitmap of the fields present and then every present
+    #              field as a 2-byte length followed by its big-endian
+    #              bytes.
+    def toBytes(self):
+        present = 0
+        body = b""
+        for i, name in enumerate(self.FIELDS):
+            value = getattr(self, name)
+            if(value is not None):
+                present |= 1 << i
+                raw = value.to_bytes((value.bit_length() + 7) // 8 or 1, "big")
+                body += len(raw).to_bytes(2, "big") + raw
+        return KEY_MAGIC + bytes([KEY_VERSION, present]) + body
+
+    # Description: Inverse of toBytes. The CRT values are read back
+    #              rather than recomputed, so a truncated, padded or
+    #              incomplete key raises ValueError instead of loading.
+    @classmethod
+    def fromBytes(cls, data):
+        if(len(data) < 6 or data[:4] != KEY_MAGIC or data[4] != KEY_VERSION):
+            raise ValueError("Not an RSA key file (or unknown version)")
+        present = data[5]
+        offset = 6
+        key = cls.__new__(cls)
+        for i, name in enumerate(cls.FIELDS):
+            value = None
+            if((present >> i) & 1):
+                if(offset + 2 > len(data)):
+                    raise ValueError("Truncated RSA key: missing %s" % name)
+                size = int.from_bytes(data[offset:offset + 2], "big")
+                if(offset + 2 + size > len(data)):
+                    raise ValueError("Truncated RSA key: missing %s" % name)
+                value = int.from_bytes(data[offset + 2:offset + 2 + size], "big")
+                offset += 2 + size
+            setattr(key, name, value)
+
+        if(offset != len(data)):
+            raise ValueError("Trailing bytes after RSA key")
+        if(key.n is None or key.e is None):
+            raise ValueError("RSA key is missing n or e")
+        if((key.p is not None or key.q is not None) and
+           None in (key.p, key.q, key.dp, key.dq, key.qInv)):
+            raise ValueError("RSA key has p and q without the CRT values")
+        return key
+
+    # Description: Writes the key to (or reads it from) path.
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.toBytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls.fromBytes(f.read())
+
+
+if __name__ == "__main__":
+    print("\nAverage seconds per prime")
+    print("-------------------------")
+    for bits, seconds in benchmarkPrimes().items():
+        print(bits, "bits:", seconds)
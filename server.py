@@ -0,0 +1,501 @@
+# Description: Local asyncio encryption service. Concurrent requests
+#              are collected for a short window, grouped by (engine,
+#              key, direction) and each group is run as one batched
+#              call with a single key schedule, so many small requests
+#              share the key expansion and the batch engines.
+# Note:        Frames are a 4-byte big-endian length and a payload.
+#              A request payload is REQUEST (id, engine, flags), the key
+#              (16 bytes for AES, 8 for DES) and whole ECB blocks; a
+#              response payload is RESPONSE (id, status) and the result
+#              blocks, or a UTF-8 error message. Requests on a
+#              connection may be pipelined and are answered as they
+#              finish, matched by id. The STATS engine returns the
+#              server counters and histograms as JSON.
+# Note:        A frame with a bad length ends the connection: the
+#              server answers it with an ERROR response whose id is
+#              FRAME_ERROR, finishes the requests already read and
+#              closes the socket.
+# Note:        Backpressure: at most maxPending requests are in flight
+#              over all connections. Past that a connection is not read
+#              until a slot frees up, so the socket buffers fill and
+#              the clients' writes wait.
+
+import aes
+import des
+
+# Used for the service, timing and the command line
+import argparse
+import asyncio
+import json
+import os
+import random
+import struct
+import subprocess
+import sys
+import time
+
+# Frame length prefix, request header and response header
+LENGTH = struct.Struct(">I")
+REQUEST = struct.Struct(">IBB")
+RESPONSE = struct.Struct(">IB")
+
+# Engine numbers of the request header
+AES, DES, STATS = 0, 1, 255
+
+# Request flags and response statuses
+DECRYPT = 1
+OK, ERROR = 0, 1
+
+# Response id of a framing error (never used as a request id)
+FRAME_ERROR = 0xffffffff
+
+# Default limits: largest frame, requests in flight, coalescing
+# window (seconds) and blocks after which a group is run at once
+MAX_FRAME = 1 << 20
+MAX_PENDING = 1024
+WINDOW = 0.002
+MAX_BLOCKS = 4096
+
+# Group sizes (blocks) from which the batch engines beat a loop over
+# the table engines; measured with the benchmarks in aes and des
+AES_BATCH_MIN = 24
+DES_BATCH_MIN = 128
+
+
+##### ENGINES #####
+
+# Description: Encrypts (or decrypts) the ECB blocks of data under
+#              one AES key schedule: aesBatch for large groups, the
+#              bytes-native table engine otherwise. Returns bytes.
+def aesBlocks(data, key, decrypt):
+    if(aes.np is not None and len(data) >= 16*AES_BATCH_MIN):
+        return aes.aesBatch(aes.np.frombuffer(data, aes.np.uint8), key, decrypt).tobytes()
+
+    words = aes.scheduleCache.get(key, decrypt)
+    out = bytearray(len(data))
+    for i in range(0, len(data), 16):
+        aes.tableBlockInto(data, i, out, i, words, decrypt)
+    return bytes(out)
+
+
+# Description: Same as aesBlocks for DES, with the bitsliced engine
+#              for large groups.
+def desBlocks(data, key, decrypt):
+    if(len(data) >= 8*DES_BATCH_MIN):
+        return des.encryptBatch(data, key, 16, decrypt)
+
+    subkeys = des.tableKeySchedule(key, 16, decrypt)
+    out = bytearray(len(data))
+    for i in range(0, len(data), 8):
+        des.tableBlockInto(data, i, out, i, subkeys)
+    return bytes(out)
+
+
+# Engine number -> (block size, key size, batched function)
+ENGINES = {AES: (16, 16, aesBlocks),
+           DES: (8, 8, desBlocks)}
+
+
+##### METRICS #####
+
+# Description: Histogram with power-of-two buckets: bucket i counts
+#              the values v with 2**(i-1) <= v < 2**i (bucket 0 counts
+#              v < 1). Latencies are recorded in microseconds.
+class Histogram:
+    def __init__(self, buckets = 32):
+        self.counts = [0] * buckets
+        self.total = 0
+        self.sum = 0
+
+    # Description: Adds one value.
+    def record(self, value):
+        bucket = min(int(value).bit_length(), len(self.counts) - 1)
+        self.counts[bucket] += 1
+        self.total += 1
+        self.sum += value
+
+    # Description: Adds the counts of another histogram.
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.total += other.total
+        self.sum += other.sum
+
+    # Description: Upper bound of the bucket holding the p-th
+    #              percentile (0 if empty).
+    def percentile(self, p):
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if(count and seen >= self.total * p / 100):
+                return 1 << i
+        return 0
+
+    # Description: Returns the count, mean, percentiles and non-empty
+    #              buckets (upper bound -> count) as a dict.
+    def summary(self):
+        return {"count": self.total, "mean": self.sum / self.total if self.total else 0,
+                "p50": self.percentile(50), "p90": self.percentile(90),
+                "p99": self.percentile(99),
+                "buckets": {1 << i: count for i, count in enumerate(self.counts) if count}}
+
+
+##### SERVER #####
+
+# Description: Collects requests for window seconds and runs each
+#              (engine, key, decrypt) group as one batched call. A group
+#              reaching maxBlocks is run straight away.
+class Coalescer:
+    def __init__(self, window = WINDOW, maxBlocks = MAX_BLOCKS):
+        self.window = window
+        self.maxBlocks = maxBlocks
+        self.groups = {}
+        self.timer = None
+        self.batchRequests = Histogram()
+        self.batchBlocks = Histogram()
+
+    # Description: Queues data and returns a future for its result.
+    def submit(self, engine, key, decrypt, data):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        group = (engine, key, decrypt)
+        entries = self.groups.setdefault(group, [0, []])
+        entries[0] += len(data) // ENGINES[engine][0]
+        entries[1].append((data, future))
+
+        if(entries[0] >= self.maxBlocks):
+            self.run(group)
+        elif(self.timer is None):
+            self.timer = loop.call_later(self.window, self.flush)
+        return future
+
+    # Description: Runs every queued group.
+    def flush(self):
+        self.timer = None
+        for group in list(self.groups):
+            self.run(group)
+
+    # Description: Runs one group and resolves its futures.
+    def run(self, group):
+        engine, key, decrypt = group
+        blocks, entries = self.groups.pop(group)
+        self.batchRequests.record(len(entries))
+        self.batchBlocks.record(blocks)
+
+        try:
+            result = ENGINES[engine][2](b"".join(data for data, future in entries), key, decrypt)
+        except Exception as error:
+            for data, future in entries:
+                if(not future.done()):
+                    future.set_exception(error)
+            return
+
+        offset = 0
+        for data, future in entries:
+            if(not future.done()):
+                future.set_result(result[offset:offset + len(data)])
+            offset += len(data)
+
+
+# Description: The service: accepts connections, reads request
+#              frames, feeds them to a Coalescer and writes responses,
+#              keeping a latency histogram per engine.
+class Server:
+    def __init__(self, window = WINDOW, maxBlocks = MAX_BLOCKS,
+                 maxPending = MAX_PENDING, maxFrame = MAX_FRAME):
+        self.coalescer = Coalescer(window, maxBlocks)
+        self.slots = asyncio.Semaphore(maxPending)
+        self.maxFrame = maxFrame
+        self.latencies = {engine: Histogram() for engine in ENGINES}
+        self.errors = 0
+        self.tasks = set()
+
+    # Description: Serves one connection until the client closes it
+    #              (or sends a bad frame), then answers the requests
+    #              already read before closing.
+    async def handle(self, reader, writer):
+        tasks = set()
+        try:
+            while(True):
+                try:
+                    length, = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+                except asyncio.IncompleteReadError:
+                    break
+                if(length < REQUEST.size or length > self.maxFrame):
+                    message = ("Bad frame length %d" % length).encode()
+                    writer.write(LENGTH.pack(RESPONSE.size + len(message)) +
+                                 RESPONSE.pack(FRAME_ERROR, ERROR) + message)
+                    self.errors += 1
+                    break
+                payload = await reader.readexactly(length)
+                start = time.perf_counter()
+
+                # Stop reading this connection while the server is full
+                await self.slots.acquire()
+                task = asyncio.ensure_future(self.answer(payload, writer, start))
+                for owner in (tasks, self.tasks):
+                    owner.add(task)
+                    task.add_done_callback(owner.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            await asyncio.gather(*tasks, return_exceptions = True)
+            writer.close()
+
+    # Description: Processes one request payload and writes its response.
+    async def answer(self, payload, writer, start):
+        try:
+            requestId, engine, flags = REQUEST.unpack_from(payload)
+            status = OK
+            try:
+                result = await self.process(engine, flags, memoryview(payload)[REQUEST.size:])
+            except Exception as error:
+                # Every failure gets a response, or the client's
+                # request would wait forever
+                status, result = ERROR, ("%s: %s" % (type(error).__name__, error)).encode()
+                self.errors += 1
+
+            writer.write(LENGTH.pack(RESPONSE.size + len(result)) +
+                         RESPONSE.pack(requestId, status) + result)
+            await writer.drain()
+            if(engine in self.latencies):
+                self.latencies[engine].record((time.perf_counter() - start) * 1e6)
+        except ConnectionError:
+            pass
+        finally:
+            self.slots.release()
+
+    # Description: Checks a request and returns its result bytes.
+    async def process(self, engine, flags, body):
+        if(engine == STATS):
+            return json.dumps(self.stats()).encode()
+        if(engine not in ENGINES):
+            raise ValueError("Unknown engine: %d" % engine)
+
+        blockSize, keySize, run = ENGINES[engine]
+        data = bytes(body[keySize:])
+        if(len(body) < keySize or not data or len(data) % blockSize):
+            raise ValueError("Expected a %d byte key and whole %d byte blocks" % (keySize, blockSize))
+        key = int.from_bytes(body[:keySize], "big")
+        return await self.coalescer.submit(engine, key, bool(flags & DECRYPT), data)
+
+    # Description: Returns the counters and histograms as a dict.
+    def stats(self):
+        names = {AES: "aes", DES: "des"}
+        return {"latencyMicroseconds": {names[e]: h.summary() for e, h in self.latencies.items()},
+                "batchRequests": self.coalescer.batchRequests.summary(),
+                "batchBlocks": self.coalescer.batchBlocks.summary(),
+                "errors": self.errors}
+
+
+# Description: Runs a Server on a Unix socket at path, or on TCP at
+#              host and port, until cancelled.
+async def serve(path = None, host = "127.0.0.1", port = 0, ready = None, **options):
+    server = Server(**options)
+    if(path):
+        listener = await asyncio.start_unix_server(server.handle, path)
+    else:
+        listener = await asyncio.start_server(server.handle, host, port)
+    if(ready is not None):
+        ready(listener)
+    async with listener:
+        await listener.serve_forever()
+
+
+##### CLIENT #####
+
+# Description: A pipelining client. request may be awaited from many
+#              tasks at once; responses are matched to them by id.
+class Client:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.waiting = {}
+        self.nextId = 0
+        self.error = None
+        self.receiver = asyncio.ensure_future(self.receive())
+
+    # Description: Connects to a Unix socket at path or to host:port.
+    @classmethod
+    async def connect(cls, path = None, host = "127.0.0.1", port = 0):
+        if(path):
+            return cls(*await asyncio.open_unix_connection(path))
+        return cls(*await asyncio.open_connection(host, port))
+
+    # Description: Reads responses and resolves the waiting requests.
+    async def receive(self):
+        try:
+            while(True):
+                length, = LENGTH.unpack(await self.reader.readexactly(LENGTH.size))
+                payload = await self.reader.readexactly(length)
+                requestId, status = RESPONSE.unpack_from(payload)
+                if(requestId == FRAME_ERROR):
+                    self.error = payload[RESPONSE.size:].decode()
+
+                # Skip ids this client is not waiting on
+                future = self.waiting.pop(requestId, None)
+                if(future is None):
+                    continue
+                if(status == OK):
+                    future.set_result(payload[RESPONSE.size:])
+                else:
+                    future.set_exception(ValueError(payload[RESPONSE.size:].decode()))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            for future in self.waiting.values():
+                future.set_exception(ConnectionError(self.error or "Connection closed"))
+            self.waiting.clear()
+
+    # Description: Sends one request and returns its result bytes.
+    async def request(self, engine, key, data = b"", decrypt = False):
+        requestId = self.nextId
+        self.nextId = (self.nextId + 1) % FRAME_ERROR
+        future = self.waiting[requestId] = asyncio.get_running_loop().create_future()
+
+        keySize = ENGINES[engine][1] if engine in ENGINES else 0
+        payload = (REQUEST.pack(requestId, engine, DECRYPT if decrypt else 0) +
+                   key.to_bytes(keySize, "big") + data)
+        self.writer.write(LENGTH.pack(len(payload)) + payload)
+        await self.writer.drain()
+        return await future
+
+    # Description: Encrypts (or decrypts) ECB blocks with AES or DES.
+    async def aes(self, data, key, decrypt = False):
+        return await self.request(AES, key, data, decrypt)
+
+    async def des(self, data, key, decrypt = False):
+        return await self.request(DES, key, data, decrypt)
+
+    # Description: Returns the server's stats as a dict.
+    async def stats(self):
+        return json.loads(await self.request(STATS, 0))
+
+    async def close(self):
+        self.writer.close()
+        self.receiver.cancel()
+
+
+##### LOAD GENERATOR #####
+
+# Description: Builds a workload of count requests, each (engine, key,
+#              data) with blocks random blocks under one of keys
+#              random keys.
+def workload(engine, count, blocks = 1, keys = 4, seed = 1):
+    rng = random.Random(seed)
+    blockSize, keySize, run = ENGINES[engine]
+    keyList = [rng.getrandbits(8*keySize) for i in range(keys)]
+    return [(engine, rng.choice(keyList), rng.randbytes(blockSize * blocks))
+            for i in range(count)]
+
+
+# Description: Runs requests through the per-call functions, one block
+#              and one call to aes.aes or des.encrypt at a time.
+#              Returns (results, requests per second).
+def direct(requests):
+    results = []
+    start = time.perf_counter()
+    for engine, key, data in requests:
+        size = ENGINES[engine][0]
+        blocks = [int.from_bytes(data[i:i + size], "big") for i in range(0, len(data), size)]
+        if(engine == AES):
+            blocks = [aes.aes(block, key) for block in blocks]
+        else:
+            blocks = [des.encrypt(block, key) for block in blocks]
+        results.append(b"".join(block.to_bytes(size, "big") for block in blocks))
+    return results, len(requests) / (time.perf_counter() - start)
+
+
+# Description: Sends requests to the server from concurrency tasks
+#              over connections connections. Returns (results, requests
+#              per second, client latency Histogram in microseconds).
+async def load(requests, concurrency = 64, connections = 4, **address):
+    clients = [await Client.connect(**address) for i in range(connections)]
+    results = [None] * len(requests)
+    latencies = Histogram()
+    cursor = iter(range(len(requests)))
+
+    async def worker(client):
+        for i in cursor:
+            engine, key, data = requests[i]
+            start = time.perf_counter()
+            results[i] = await client.request(engine, key, data)
+            latencies.record((time.perf_counter() - start) * 1e6)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(clients[i % connections]) for i in range(concurrency)])
+    rate = len(requests) / (time.perf_counter() - start)
+
+    for client in clients:
+        await client.close()
+    return results, rate, latencies
+
+
+# Description: Compares the server against the direct path on the
+#              same workload (and checks they agree). Returns a dict.
+async def compare(engine, count, blocks, keys, concurrency, connections, **address):
+    requests = workload(engine, count, blocks, keys)
+    expected, directRate = direct(requests)
+    results, serverRate, latencies = await load(requests, concurrency, connections, **address)
+
+    client = await Client.connect(**address)
+    stats = await client.stats()
+    await client.close()
+    return {"engine": "aes" if engine == AES else "des", "requests": count,
+            "blocksPerRequest": blocks, "keys": keys, "concurrency": concurrency,
+            "match": results == expected,
+            "directRequestsPerSecond": directRate,
+            "serverRequestsPerSecond": serverRate,
+            "clientLatencyMicroseconds": latencies.summary(),
+            "server": stats}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Coalescing encryption service")
+    parser.add_argument("command", choices = ("serve", "load"),
+                        help = "serve, or run the load generator (spawns a server "
+                        "unless --port or --unix points at a running one)")
+    parser.add_argument("--unix", help = "Unix socket path")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 0)
+    parser.add_argument("--window", type = float, default = WINDOW,
+                        help = "coalescing window in seconds")
+    parser.add_argument("--max-blocks", type = int, default = MAX_BLOCKS)
+    parser.add_argument("--max-pending", type = int, default = MAX_PENDING)
+    parser.add_argument("--engine", choices = ("aes", "des"), default = "aes")
+    parser.add_argument("--requests", type = int, default = 5000)
+    parser.add_argument("--blocks", type = int, default = 1, help = "blocks per request")
+    parser.add_argument("--keys", type = int, default = 4, help = "distinct keys")
+    parser.add_argument("--concurrency", type = int, default = 256)
+    parser.add_argument("--connections", type = int, default = 4)
+    args = parser.parse_args()
+
+    if(args.command == "serve"):
+        def ready(listener):
+            print("Listening on", ", ".join(str(s.getsockname()) for s in listener.sockets), flush = True)
+        asyncio.run(serve(args.unix, args.host, args.port, ready, window = args.window,
+                          maxBlocks = args.max_blocks, maxPending = args.max_pending))
+        sys.exit(0)
+
+    # Spawn a server in its own process so it does not share a CPU
+    # with the load generator
+    child = None
+    if(not args.unix and not args.port):
+        args.unix = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 "__pycache__", "server-%d.sock" % os.getpid())
+        child = subprocess.Popen([sys.executable, os.path.abspath(__file__), "serve",
+                                  "--unix", args.unix, "--window", str(args.window),
+                                  "--max-blocks", str(args.max_blocks),
+                                  "--max-pending", str(args.max_pending)],
+                                 stdout = subprocess.PIPE)
+        child.stdout.readline()
+
+    try:
+        address = {"path": args.unix} if args.unix else {"host": args.host, "port": args.port}
+        engine = AES if args.engine == "aes" else DES
+        print(json.dumps(asyncio.run(compare(engine, args.requests, args.blocks, args.keys,
+                                             args.concurrency, args.connections, **address)),
+                         indent = 2))
+    finally:
+        if(child is not None):
+            child.terminate()
+            child.wait()
+            os.remove(args.unix)
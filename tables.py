@@ -0,0 +1,261 @@
+# Description: Compact base tables and a shared cache of derived
+#              tables for the AES and DES engines.
+# Note:        The base tables from app.py are kept as bytes (one byte
+#              per entry instead of a Python int object each). The
+#              derived tables (AES T-tables, DES per-byte permutation
+#              tables and SP-boxes, the full GF(2^8) multiplication
+#              table) are generated once into a versioned binary cache
+#              file and then loaded with mmap, so a process importing
+#              aes or des reads them instead of deriving them again.
+# Note:        aes and des copy the rows they index per block into
+#              lists (see lists), so each process still holds its own
+#              copy of those; only rows used through get() directly
+#              (such as the GF table in aes.aesBatch) stay shared
+#              pages. The cache saves import time, not memory.
+# Note:        The cache lives at CACHE_PATH (override with the
+#              CRYPTO_TABLE_CACHE environment variable; set it to an
+#              empty string to always derive in memory). It is rebuilt
+#              whenever CACHE_VERSION, any table in app.py or this file
+#              changes.
+
+# All the AES and DES tables (app for appendix)
+import app
+
+# Used for the cache file
+from array import array
+import hashlib
+import mmap
+import os
+import struct
+import sys
+
+CACHE_VERSION = 1
+CACHE_PATH = os.environ.get("CRYPTO_TABLE_CACHE",
+                            os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                         "__pycache__", "tables-v%d.bin" % CACHE_VERSION))
+
+
+##### BASE TABLES #####
+
+BASE_NAMES = ("IP", "oIP", "PC1", "PC2", "LS", "E", "P",
+              "S1", "S2", "S3", "S4", "S5", "S6", "S7", "S8",
+              "S", "oS", "SR", "oSR", "MC", "oMC", "RC")
+
+# One bytes object per app table (every entry fits in a byte)
+BASE = {name: bytes(getattr(app, name)) for name in BASE_NAMES}
+
+
+##### DERIVED TABLES #####
+
+# Description: Multiplies a by b over F[x]/(x**8 + x**4 + x**3 + x + 1),
+#              as in aes.MixColumns.
+def gfMultiply(a, b):
+    result = 0
+    while(a):
+        result ^= (a & 1)*b
+        b = ((b << 1) & 0xff) ^ (b >> 7)*0b11011
+        a >>= 1
+    return result
+
+
+# Description: The 256x256 GF(2^8) multiplication table, one row per
+#              first factor.
+def gfTable():
+    return [[gfMultiply(a, b) for b in range(256)] for a in range(256)]
+
+
+# Description: The four combined SubBytes/MixColumns tables for box
+#              and matrix. Entry x of table j is the column produced by
+#              a single byte x in row j, with row 0 in the high byte.
+def aesTables(box, matrix):
+    tables = []
+    for j in range(4):
+        table = []
+        for x in range(256):
+            word = 0
+            for r in range(4):
+                word = (word << 8) | gfMultiply(matrix[4*r + j], box[x])
+            table.append(word)
+        tables.append(table)
+    return tables
+
+
+# Description: Same bit placement as des.permute.
+def bitPermute(text, box):
+    result = 0
+    for i in range(len(box)):
+        result = (result << 1) | ((text >> box[i]) & 1)
+    return result
+
+
+# Description: One 256 entry table per input byte of the permutation
+#              box, so permuting is one lookup per byte ORed together.
+def permuteTables(box):
+    width = (max(box) // 8) + 1
+    return [[bitPermute(v << 8*k, box) for v in range(256)] for k in range(width)]
+
+
+# Description: The eight S-boxes merged with the P permutation. Entry
+#              x of box j is the permuted output of S-box j on input x.
+def spBoxes():
+    sBoxes = [app.S1, app.S2, app.S3, app.S4,
+              app.S5, app.S6, app.S7, app.S8]
+    boxes = []
+    for j in range(8):
+        box = []
+        for bits in range(64):
+            sRow = 2*(bits >> 5) + (bits & 1)
+            sColumn = (bits & 0x1e) >> 1
+            box.append(bitPermute(sBoxes[j][sRow*16 + sColumn] << 4*(7-j), app.P))
+        boxes.append(box)
+    return boxes
+
+
+# Derived tables as name -> (array typecode, builder returning rows)
+DERIVED = {"Te": ("I", lambda: aesTables(app.S, app.MC)),
+           "Td": ("I", lambda: aesTables(app.oS, app.oMC)),
+           "GF": ("B", gfTable),
+           "IP": ("Q", lambda: permuteTables(app.IP)),
+           "oIP": ("Q", lambda: permuteTables(app.oIP)),
+           "E": ("Q", lambda: permuteTables(app.E)),
+           "PC1": ("Q", lambda: permuteTables(app.PC1)),
+           "PC2": ("Q", lambda: permuteTables(app.PC2)),
+           "SP": ("I", spBoxes)}
+
+
+##### CACHE FILE #####
+
+# Header: magic, version, fingerprint of app.py and table count, then
+# one directory entry per table: name, typecode, rows, columns, offset
+MAGIC = b"CTAB"
+HEADER = struct.Struct("<4sI32sI")
+ENTRY = struct.Struct("<16sc2xIIQ")
+
+
+# Description: Hash of the cache version, every base table and the
+#              source of this module (the builders and the DERIVED
+#              layout), so a cache built from other tables or by other
+#              code is never used.
+def fingerprint():
+    digest = hashlib.sha256(b"%d" % CACHE_VERSION)
+    for name in BASE_NAMES:
+        digest.update(name.encode() + b":" + BASE[name])
+    with open(os.path.abspath(__file__), "rb") as f:
+        digest.update(b"source:" + f.read())
+    return digest.digest()
+
+
+# Description: Builds every derived table and returns the contents of
+#              a cache file holding them.
+def generate():
+    directory = b""
+    body = b""
+    offset = HEADER.size + ENTRY.size * len(DERIVED)
+
+    for name, (typecode, build) in DERIVED.items():
+        rows = build()
+        data = array(typecode, [x for row in rows for x in row])
+        if(sys.byteorder != "little"):
+            data.byteswap()
+
+        # Keep every table 8-byte aligned
+        body += bytes(-(offset + len(body)) % 8)
+        directory += ENTRY.pack(name.encode(), typecode.encode(), len(rows),
+                                len(rows[0]), offset + len(body))
+        body += data.tobytes()
+
+    return HEADER.pack(MAGIC, CACHE_VERSION, fingerprint(), len(DERIVED)) + directory + body
+
+
+# Description: Returns a dict of table name -> list of rows, each row
+#              a read-only memoryview of the right item type over
+#              buffer (the mmapped file or the generated bytes).
+def parse(buffer):
+    magic, version, stamp, count = HEADER.unpack_from(buffer, 0)
+    if(magic != MAGIC or version != CACHE_VERSION or stamp != fingerprint()):
+        raise ValueError("Stale or foreign table cache")
+
+    view = memoryview(buffer)
+    result = {}
+    for i in range(count):
+        name, typecode, rows, columns, offset = ENTRY.unpack_from(buffer, HEADER.size + i*ENTRY.size)
+        typecode = typecode.decode()
+        size = array(typecode).itemsize * columns
+        result[name.rstrip(b"\0").decode()] = [view[offset + r*size:offset + (r + 1)*size].cast(typecode)
+                                               for r in range(rows)]
+    return result
+
+
+# Description: Maps the cache file at path, writing it first if it is
+#              missing or stale. Falls back to tables generated in
+#              memory if path is empty or cannot be written.
+def load(path = CACHE_PATH):
+    if(path and sys.byteorder == "little"):
+        for attempt in range(2):
+            try:
+                with open(path, "rb") as f:
+                    return parse(mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ))
+            except (OSError, ValueError, struct.error):
+                pass
+
+            # (Re)build the cache file atomically, then map it
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok = True)
+                with open(path + ".%d.tmp" % os.getpid(), "wb") as f:
+                    f.write(generate())
+                os.replace(path + ".%d.tmp" % os.getpid(), path)
+            except OSError:
+                break
+
+    return parse(generate())
+
+
+# Derived tables of this process (see load)
+derived = None
+
+
+# Description: Returns the rows of derived table name, loading the
+#              cache on first use.
+def get(name):
+    global derived
+    if(derived is None):
+        derived = load()
+    return derived[name]
+
+
+# Description: Returns the rows of derived table name as lists, the
+#              fastest form for element lookups in pure Python (about
+#              3x faster than indexing the memoryviews), at the cost of
+#              a private copy per process.
+def lists(name):
+    return [list(row) for row in get(name)]
+
+
+# Description: Measures the time and peak RSS of a fresh interpreter
+#              importing aes and des, with the cache and with tables
+#              derived in memory. Returns a dict of case -> {ms, rssKB}.
+def benchmark(runs = 5):
+    import subprocess, json
+    script = ("import time, resource; t = time.perf_counter(); import aes, des; "
+              "print(json.dumps([(time.perf_counter() - t)*1e3, "
+              "resource.getrusage(resource.RUSAGE_SELF).ru_maxrss]))")
+    script = "import json; " + script
+    load()
+    results = {}
+
+    for case, path in (("cache", CACHE_PATH), ("derived", "")):
+        env = dict(os.environ, CRYPTO_TABLE_CACHE = path)
+        samples = [json.loads(subprocess.check_output([sys.executable, "-c", script], env = env,
+                                                      cwd = os.path.dirname(os.path.abspath(__file__))))
+                   for i in range(runs)]
+        results[case] = {"ms": sorted(s[0] for s in samples)[runs // 2],
+                         "rssKB": sorted(s[1] for s in samples)[runs // 2]}
+
+    return results
+
+
+if __name__ == "__main__":
+    print("\nImport aes, des (median ms, peak RSS KB)")
+    print("----------------------------------------")
+    for case, result in benchmark().items():
+        print(case, result["ms"], result["rssKB"])
@@ -1,3 +1,17 @@
+#Used by the batch command
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import os
+import sys
+import time
+
+#NumPy is only needed for the key length analysis
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
 #Description: Takes the text given by cipher and
 #             computes the index of coincidence.
 def getIoC(cipher):
@@ -16,23 +30,146 @@ def getIoC(cipher):
     return IoC / len(cipher)**2
 
 
-#Description: Takes the text given by cipher and prints
-#             the most likely Viginere keyword lengths.
-def getKeyLengths(cipher):
-    print("\n---Possible Keyword Lengths---")
-    IoC = 0
+#Standard English IoC and default analysis settings
+ENGLISH_IOC = 0.067
+MAX_KEY_LENGTH = 40
+CUTOFF = 0.005
+
+
+#Description: Maps the letters of cipher to a uint8 array of
+#             values 0 - 25 (A - Z). Everything else is dropped.
+def toArray(cipher):
+    data = np.frombuffer(cipher.upper().encode("ascii", "ignore"), np.uint8)
+    return data[(data >= 65) & (data <= 90)] - 65
+
+
+#Description: Returns the letter counts of every column of text
+#             for one key length as a (length, 26) array. offset
+#             is the position of text[0] in the whole ciphertext,
+#             so counts of consecutive chunks can be added up.
+#Note:        One bincount over (column, letter) pairs, so the
+#             work is linear in the size of text.
+def columnCounts(text, length, offset = 0):
+    columns = (np.arange(offset, offset + text.size) % length) * 26
+    return np.bincount(columns + text, minlength = 26 * length).reshape(length, 26)
+
+
+#Description: Returns the average IoC of the columns in counts.
+#Note:        Columns use the n(n-1) form of the IoC, which does
+#             not grow as the columns get shorter.
+def columnScore(counts):
+    sizes = counts.sum(axis = 1)
+    return float(np.mean((counts * (counts - 1)).sum(axis = 1) /
+                         np.maximum(sizes * (sizes - 1), 1)))
+
+
+#Description: Returns the average IoC of the columns of text for
+#             every key length from 1 to maxLength (index 0 is
+#             length 1). text is an array from toArray.
+def keyLengthScores(text, maxLength = MAX_KEY_LENGTH):
+    scores = np.zeros(maxLength)
+    for length in range(1, min(maxLength, text.size // 2) + 1):
+        scores[length - 1] = columnScore(columnCounts(text, length))
+    return scores
+
+
+#Description: Turns the scores from keyLengthScores into a list of
+#             (length, IoC, percent match) tuples, best first.
+#             Only lengths whose IoC is within cutoff of English
+#             are kept (all of them if cutoff is None).
+def rankKeyLengths(scores, cutoff = CUTOFF):
+    candidates = []
+
+    for i in range(len(scores)):
+        difference = abs(scores[i] - ENGLISH_IOC)
+        if(scores[i] and (cutoff is None or difference < cutoff)):
+            match = 100*(ENGLISH_IOC - difference) / ENGLISH_IOC
+            candidates.append((i + 1, float(scores[i]), float(match)))
+
+    #Best match first, shorter keys first on ties
+    candidates.sort(key = lambda c: (-round(c[2], 6), c[0]))
+    return candidates
+
+
+#Description: Takes the text given by cipher and returns the most
+#             likely Viginere keyword lengths (see rankKeyLengths).
+def getKeyLengths(cipher, maxLength = MAX_KEY_LENGTH, cutoff = CUTOFF):
+    if(np is None):
+        raise ImportError("getKeyLengths requires NumPy")
+    return rankKeyLengths(keyLengthScores(toArray(cipher), maxLength), cutoff)
+
+
+#Relative frequencies of A - Z in English text
+ENGLISH = [0.08167, 0.01492, 0.02782, 0.04253, 0.12702, 0.02228, 0.02015,
+           0.06094, 0.06966, 0.00153, 0.00772, 0.04025, 0.02406, 0.06749,
+           0.07507, 0.01929, 0.00095, 0.05987, 0.06327, 0.09056, 0.02758,
+           0.00978, 0.02360, 0.00150, 0.01974, 0.00074]
+
+
+#Description: Recovers the keyword of cipher. Each column of the
+#             text is decrypted with all 26 shifts at once and the
+#             shift whose letter counts are closest to English (by
+#             chi-squared) gives that key letter.
+#Note:        If length is not given, the shortest candidate from
+#             getKeyLengths is used (multiples of the true length
+#             score just as well).
+def getKey(cipher, length = None):
+    if(np is None):
+        raise ImportError("getKey requires NumPy")
+    text = toArray(cipher)
+    length = length or pickLength(keyLengthScores(text))
+    return keyFromCounts(columnCounts(text, length))
 
-    #Calculate average IoC's
-    for i in range(1, len(cipher)):
-        for j in range(i):
-            IoC += getIoC(cipher[j::i])
-        IoC /= i
 
-        #Standard English IoC: ~0.067
-        #Current Difference Cutoff: 0.005
-        if(abs(IoC - 0.067) < 0.005):
-            print("Keylength: ", i, "Percent Match: ", end='')
-            print(100*(0.067 - abs(IoC - 0.067)) / 0.067, "%")
+#Description: Returns the shortest likely key length for the scores
+#             from keyLengthScores (the best one if none is within
+#             the cutoff).
+def pickLength(scores):
+    candidates = rankKeyLengths(scores)
+    if(candidates):
+        return min(c[0] for c in candidates)
+    candidates = rankKeyLengths(scores, None)
+    return candidates[0][0] if candidates else 1
+
+
+#Description: Returns the keyword whose letters best fit the
+#             (length, 26) column counts from columnCounts.
+def keyFromCounts(counts):
+    shifts = (np.arange(26)[:, None] + np.arange(26)[None, :]) % 26
+    observed = counts[:, shifts]
+    expected = counts.sum(axis = 1)[:, None, None] * np.array(ENGLISH)
+    chi = ((observed - expected)**2 / expected).sum(axis = 2)
+
+    return "".join(chr(65 + s) for s in chi.argmin(axis = 1))
+
+
+#Description: Returns the str.translate tables that shift A - Z by
+#             every letter of key (back, if decrypting). Other
+#             characters are left unchanged.
+def translateTables(key, decrypt = False):
+    key = key.upper()
+    if(not key or not all("A" <= letter <= "Z" for letter in key)):
+        raise ValueError("The keyword must be one or more letters A - Z")
+
+    tables = []
+    for letter in key:
+        shift = (ord(letter) - 65) * (-1 if decrypt else 1)
+        tables.append({65 + c: 65 + (c + shift) % 26 for c in range(26)})
+    return tables
+
+
+#Description: Encrypts (or decrypts) text with key and returns the
+#             result. Each key position is one str.translate over
+#             that position's slice, so the cost is linear in the
+#             size of text.
+#Note:        As in encrypt, every character uses up a key position.
+def translate(text, key, decrypt = False):
+    tables = translateTables(key, decrypt)
+    result = list(text)
+
+    for i in range(len(tables)):
+        result[i::len(tables)] = text[i::len(tables)].translate(tables[i])
+    return "".join(result)
 
 
 #Description: Encrypts the text given by cipher and
@@ -40,23 +177,94 @@ def getKeyLengths(cipher):
 def encrypt(cipher):
     key = input("\nPlease enter the keyword: ").upper()
     choice = input("Are you decrypting (y/n)? ")
-    encrypt = ''
+    try:
+        print('\n', translate(cipher, key, choice == 'y'), '\n')
+    except ValueError as error:
+        print('\n', error, '\n')
 
-    #Change key for decryption
-    if(choice == 'y'):
-        temp = ''
-        for i in range(len(key)):
-            temp += chr((65 - ord(key[i])) % 26 + 65)
-        key = temp
 
-    #Encryption
-    for i in range(len(cipher)):
-        encrypt += chr((ord(cipher[i]) + ord(key[i % len(key)]) - 2*65) % 26 + 65)
+#Default characters read at a time by analyzeFile
+CHUNK_SIZE = 1 << 20
+
 
-    print('\n', encrypt, '\n')
+#Description: Analyzes one ciphertext file without loading it whole:
+#             column counts for every key length are added up chunk
+#             by chunk. Returns a dict with the IoC, the ranked key
+#             lengths, the recovered keyword and the time taken (or
+#             the error, if the file could not be read).
+def analyzeFile(path, maxLength = MAX_KEY_LENGTH, chunkSize = CHUNK_SIZE):
+    start = time.perf_counter()
+    counts = [np.zeros((length, 26), np.int64) for length in range(1, maxLength + 1)]
+    letters = 0
+
+    try:
+        with open(path, "r", errors = "ignore") as f:
+            for chunk in iter(lambda: f.read(chunkSize), ""):
+                text = toArray(chunk)
+                for length in range(1, maxLength + 1):
+                    counts[length - 1] += columnCounts(text, length, letters)
+                letters += text.size
+    except OSError as error:
+        return {"file": path, "error": str(error)}
+
+    scores = np.zeros(maxLength)
+    for length in range(1, min(maxLength, letters // 2) + 1):
+        scores[length - 1] = columnScore(counts[length - 1])
+    key = keyFromCounts(counts[pickLength(scores) - 1]) if letters else None
+
+    return {"file": path, "letters": letters,
+            "IoC": float((counts[0]**2).sum()) / letters**2 if letters else 0.0,
+            "keyLengths": rankKeyLengths(scores)[:10], "key": key,
+            "seconds": time.perf_counter() - start}
+
+
+#Description: Returns the files matched by pattern, which is either
+#             a directory (every file in it) or a glob.
+def findFiles(pattern):
+    if(os.path.isdir(pattern)):
+        pattern = os.path.join(pattern, "*")
+    return sorted(path for path in glob.glob(pattern, recursive = True)
+                  if os.path.isfile(path))
+
+
+#Description: Analyzes every file matched by pattern on a pool of
+#             worker processes and yields the analyzeFile results in
+#             file order.
+def analyzeFiles(pattern, workers = None, maxLength = MAX_KEY_LENGTH,
+                 chunkSize = CHUNK_SIZE):
+    paths = findFiles(pattern)
+    with ProcessPoolExecutor(workers) as pool:
+        yield from pool.map(analyzeFile, paths, [maxLength]*len(paths),
+                            [chunkSize]*len(paths), chunksize = 8)
+
+
+#Description: Batch command: writes one JSON line per file matched
+#             by each pattern to output (stdout by default).
+def batch(argv):
+    import argparse, json
+    parser = argparse.ArgumentParser(prog = "viginere.py batch",
+                                     description = "Batch Vigenere analysis")
+    parser.add_argument("patterns", nargs = "+", help = "directories or globs")
+    parser.add_argument("--workers", type = int)
+    parser.add_argument("--max-length", type = int, default = MAX_KEY_LENGTH)
+    parser.add_argument("--chunk-size", type = int, default = CHUNK_SIZE)
+    parser.add_argument("--output", help = "JSON lines file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    output = open(args.output, "w") if args.output else sys.stdout
+    for pattern in args.patterns:
+        for result in analyzeFiles(pattern, args.workers, args.max_length, args.chunk_size):
+            output.write(json.dumps(result) + "\n")
+    if(args.output):
+        output.close()
 
 
 if __name__ == "__main__":
+    #Non-interactive batch mode
+    if(sys.argv[1:2] == ["batch"]):
+        batch(sys.argv[2:])
+        exit()
+
     print("\nVigenere Cipher Analysis")
     print("------------------------")
     choice = 0
@@ -66,11 +274,12 @@ if __name__ == "__main__":
         print("1) Index of Coincidence")
         print("2) Keyword Lengths")
         print("3) Encrypt/Decrypt")
-        print("4) Exit")
+        print("4) Recover Keyword")
+        print("5) Exit")
         choice = input("Please select an option: ")
 
         #Check for exit
-        if(choice == '4'):
+        if(choice == '5'):
             break
 
         #Get cipher text
@@ -84,9 +293,15 @@ if __name__ == "__main__":
         if(choice == '1'):
             print("Index of Coincidence: ", getIoC(cipher), "\n")
         elif(choice == '2'):
-            getKeyLengths(cipher)
+            print("\n---Possible Keyword Lengths---")
+            for length, IoC, match in getKeyLengths(cipher):
+                print("Keylength: ", length, "Percent Match: ", match, "%")
         elif(choice == '3'):
             encrypt(cipher)
+        elif(choice == '4'):
+            key = getKey(cipher)
+            print("\nKeyword: ", key)
+            print('\n', translate(cipher, key, True), '\n')
 
     #Clean up and exit
     exit()